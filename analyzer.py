@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+# Shared spectral analysis for RepeaterPi tone decoders
+#
+# Every received buffer is unpacked once into a numarray view and run
+# through a single filter bank holding the CTCSS and DTMF frequencies.
+# Frequencies are grouped by window length and each group is computed with
+# one matrix product; results are published to the decoders.
+
+# Standard Python modules
+import math
+import numarray
+
+#########################
+class Bank:
+	"""Correlators for a set of frequencies sharing the same window length"""
+	#########################
+	def __init__(self, samplerate, freqs, windowsize):
+		self.freqs = list(freqs)
+		self.windowsize = windowsize
+		self.callbacks = []
+		sinrows, cosrows = [], []
+		for freq in self.freqs:
+			k = 2*math.pi*freq/samplerate
+			sinrows.append([math.sin(k*x) for x in xrange(windowsize)])
+			cosrows.append([math.cos(k*x) for x in xrange(windowsize)])
+		self.sinmatrix = numarray.array(sinrows)
+		self.cosmatrix = numarray.array(cosrows)
+		self.window = numarray.zeros(windowsize, numarray.Float64)
+		self.fill = 0
+
+	#########################
+	def feed(self, samples):
+		"""Accumulate samples and publish powers for every full window"""
+		position, total = 0, len(samples)
+		while position < total:
+			count = min(total - position, self.windowsize - self.fill)
+			self.window[self.fill:self.fill+count] = samples[position:position+count]
+			self.fill += count
+			position += count
+			if self.fill < self.windowsize: break
+			self.fill = 0
+			window = self.window
+			powers = numarray.dot(self.sinmatrix, window)**2 + \
+				numarray.dot(self.cosmatrix, window)**2
+			energy = numarray.dot(window, window)
+			for indexes, callback in self.callbacks:
+				callback([powers[i] for i in indexes], energy)
+
+#########################
+class Analyzer:
+	"""Unpack received audio once and feed a fused filter bank.
+
+	Decoders subscribe with their frequencies and window length; a bank is
+	shared by every subscriber with the same window length.
+	"""
+	SAMPLETYPE = {1: numarray.Int8, 2: numarray.Int16}
+
+	#########################
+	def __init__(self, samplerate=8000, samplewidth=2):
+		if samplewidth not in self.SAMPLETYPE:
+			raise ValueError, "Invalid sample width: %s" %samplewidth
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.banks = {}
+		self.subscribers = {}
+
+	#########################
+	def subscribe(self, freqs, windowsize, callback):
+		"""Call callback(powers, energy) for every window of <windowsize> samples.
+
+		<powers> holds the squared correlation for each of <freqs> and
+		<energy> the sum of squared samples of the window.
+		"""
+		subscribers = self.subscribers.setdefault(windowsize, [])
+		subscribers.append((list(freqs), callback))
+		allfreqs = []
+		for freqs, callback in subscribers:
+			allfreqs.extend([f for f in freqs if f not in allfreqs])
+		bank = Bank(self.samplerate, allfreqs, windowsize)
+		bank.callbacks = [([allfreqs.index(f) for f in freqs], callback) \
+			for freqs, callback in subscribers]
+		self.banks[windowsize] = bank
+
+	#########################
+	def add_ctcss(self, decoder):
+		"""Publish results to a ctcss.Decoder"""
+		self.subscribe(decoder.detect_tones, decoder.windowsize, \
+			lambda powers, energy: decoder.detect(powers))
+
+	#########################
+	def add_dtmf(self, decoder):
+		"""Publish results to a dtmf.Decoder"""
+		freqs = decoder.LOWFREQS + decoder.HIGHFREQS
+		self.subscribe(freqs, decoder.binsize, \
+			lambda powers, energy: decoder.detect(decoder.normalize(dict(zip(freqs, powers)), energy)))
+
+	#########################
+	def add_cw(self, decoder):
+		"""Publish results to a cs.Decoder (CW)"""
+		self.subscribe([decoder.freq], decoder.blocksize, \
+			lambda powers, energy: decoder.detect(powers[0], energy))
+
+	#########################
+	def feed(self, buffer):
+		"""Analyse a buffer of audio"""
+		samples = numarray.fromstring(buffer, self.SAMPLETYPE[self.samplewidth])
+		for bank in self.banks.values():
+			bank.feed(samples)
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+
+# Preallocated audio blocks for RepeaterPi
+#
+# Blocks are bytearrays of a fixed size, recycled through the pool so the
+# capture path (Radio.read_block) reads and processes audio in place and
+# passes it on to the decoders, the peer and the transmitter as buffer()
+# views instead of allocating new strings on every fragment.
+
+#########################
+class BufferPool:
+	"""Pool of <count> preallocated blocks of <blocksize> bytes.
+
+	A block taken with get() belongs to the caller until it is given back
+	with put(). If the pool runs dry a new block is allocated (and counted
+	in <allocated>), so a leak shows up as a growing counter. Blocks of
+	another size (from a pool replaced after a fragment size change) are
+	dropped by put().
+	"""
+	#########################
+	def __init__(self, blocksize, count=8):
+		self.blocksize = blocksize
+		self.free = [bytearray(blocksize) for x in range(count)]
+		self.allocated = 0
+
+	#########################
+	def get(self):
+		if self.free: return self.free.pop()
+		self.allocated += 1
+		return bytearray(self.blocksize)
+
+	#########################
+	def put(self, block):
+		if len(block) == self.blocksize: self.free.append(block)
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# Peer link codecs for RepeaterPi
+#
+# 16 bit linear PCM doubles the bandwidth telephony codecs need, so links
+# over thin backhaul can use G.711 (u-law, A-law, 8 bits/sample) or IMA
+# ADPCM (4 bits/sample). Audio is converted in whole frames with audioop;
+# ADPCM state is kept across frames. Both ends agree on codec and frame
+# size with a one line handshake.
+
+# Standard Python modules
+import audioop
+
+# Bits per encoded sample, in order of preference for negotiation
+CODECS = {"adpcm": 4, "ulaw": 8, "alaw": 8, "pcm": 16}
+PREFERENCE = ["adpcm", "ulaw", "alaw", "pcm"]
+
+#########################
+class Codec:
+	"""Encode/decode 16 bit linear audio in frames of <framesize> samples.
+
+	Partial frames are kept until the next call, so encode() and decode()
+	accept buffers of any size.
+	"""
+	SAMPLEWIDTH = 2
+
+	#########################
+	def __init__(self, name, framesize=160):
+		if name not in CODECS:
+			raise ValueError, "Unknown codec: %s" %name
+		if framesize <= 0 or framesize % 2:
+			raise ValueError, "Frame size must be an even number of samples: %s" %framesize
+		self.name = name
+		self.framesize = framesize
+		self.pcm_framesize = framesize * self.SAMPLEWIDTH
+		self.encoded_framesize = framesize * CODECS[name] / 8
+		self.encode_state = self.decode_state = None
+		self.encode_pending = self.decode_pending = ""
+
+	#########################
+	def split(self, data, pending, size):
+		"""Return (whole frames, remainder) of pending + data"""
+		if pending: data = pending + str(data)
+		length = len(data) - len(data) % size
+		return data[:length], data[length:]
+
+	#########################
+	def encoded_size(self, length):
+		"""Return the encoded size of <length> bytes of linear audio"""
+		return length * CODECS[self.name] / (8 * self.SAMPLEWIDTH)
+
+	#########################
+	def encode(self, buffer):
+		"""Encode linear audio, return the encoded whole frames"""
+		frames, self.encode_pending = self.split(buffer, self.encode_pending, self.pcm_framesize)
+		if not frames or self.name == "pcm": return frames
+		if self.name == "ulaw": return audioop.lin2ulaw(frames, self.SAMPLEWIDTH)
+		elif self.name == "alaw": return audioop.lin2alaw(frames, self.SAMPLEWIDTH)
+		data, self.encode_state = audioop.lin2adpcm(frames, self.SAMPLEWIDTH, self.encode_state)
+		return data
+
+	#########################
+	def decode(self, data):
+		"""Decode data received from the peer, return linear audio"""
+		frames, self.decode_pending = self.split(data, self.decode_pending, self.encoded_framesize)
+		if not frames or self.name == "pcm": return frames
+		if self.name == "ulaw": return audioop.ulaw2lin(frames, self.SAMPLEWIDTH)
+		elif self.name == "alaw": return audioop.alaw2lin(frames, self.SAMPLEWIDTH)
+		buffer, self.decode_state = audioop.adpcm2lin(frames, self.SAMPLEWIDTH, self.decode_state)
+		return buffer
+
+#########################
+def offer(codecs=PREFERENCE, framesize=160):
+	"""Return the handshake line announcing supported codecs and frame size"""
+	return "CODEC %s FRAME %d\n" %(",".join(codecs), framesize)
+
+#########################
+def choose(local, remote):
+	"""Choose codec and frame size from two handshake lines.
+
+	The result does not depend on which side is local: the codec is the
+	first of PREFERENCE supported by both, the frame the smallest of both.
+	"""
+	offers = []
+	for line in (local, remote):
+		fields = line.split()
+		if len(fields) != 4 or fields[0] != "CODEC" or fields[2] != "FRAME":
+			raise ValueError, "Invalid codec offer: %s" %line.strip()
+		offers.append((fields[1].split(","), int(fields[3])))
+	common = [x for x in PREFERENCE if x in offers[0][0] and x in offers[1][0]]
+	if not common:
+		raise ValueError, "No common codec: %s / %s" %(local.strip(), remote.strip())
+	return common[0], min(offers[0][1], offers[1][1])
+
+#########################
+def negotiate(peerfd, codecs=PREFERENCE, framesize=160):
+	"""Exchange offers on a link (file object) and return the agreed Codec"""
+	local = offer(codecs, framesize)
+	peerfd.write(local)
+	peerfd.flush()
+	remote = peerfd.readline()
+	if not remote: raise IOError, "Link closed during codec negotiation"
+	name, framesize = choose(local, remote)
+	return Codec(name, framesize)
@@ -143,6 +143,137 @@ if __name__ == '__main__':
 
 
 
+# CW decode
+
+# Streaming Morse decoder: a single bin Goertzel filter measures the tone
+# level on short blocks, an adaptive threshold keys it, and key down/up
+# times (tracked against the estimated speed) are turned into elements.
+# Characters are looked up in a tree built from morsetab.
+
+import struct, time
+
+# Lookup tree stored as a heap: root is 1, '.' goes to 2*i, '-' to 2*i+1
+def mktree():
+    depth = max([len(code) for code in morsetab.values()])
+    tree = [None] * 2**(depth + 1)
+    for char, code in morsetab.items():
+        if code == ' ' or char != char.upper(): continue
+        index = 1
+        for element in code:
+            index = 2*index + (element == '-')
+        if not tree[index]: tree[index] = char
+    return tree
+
+morsetree = mktree()
+
+class Decoder:
+    BLOCKTIME = 0.005                   # seconds per Goertzel block
+    MINLEVEL = 0.01                     # minimum tone level (fraction of full scale)
+    SNR = 3.0                           # tone level over noise floor to key
+    WEIGHT = 0.1                        # level and speed tracking weight
+    DECAYTIME = 0.5                     # seconds for the tone level to fade on key up
+    MAXSKEW = 0.5                       # seconds audio may lag wall time (skipped audio)
+    SAMPLEFORMAT = {1: 'b', 2: 'h'}
+
+    def __init__(self, samplerate=8000, samplewidth=2, freq=800.0, wpm=20):
+        if samplewidth not in self.SAMPLEFORMAT:
+            raise ValueError, "Invalid sample width: %s" %samplewidth
+        self.samplerate = samplerate
+        self.samplewidth = samplewidth
+        self.freq = freq
+        self.samplemax = 2.0**(8*samplewidth) / 2.0
+        self.blocksize = int(samplerate * self.BLOCKTIME)
+        self.format = '<%d%s' % (self.blocksize, self.SAMPLEFORMAT[samplewidth])
+        self.coeff = 2.0*math.cos(2.0*math.pi*freq/samplerate)
+        self.window = bytearray(self.blocksize * samplewidth)
+        self.fill = 0
+        self.high = self.low = 0.0
+        self.keydown = False
+        self.length = 0                 # blocks in current key state
+        self.dot = 1.2 / wpm / self.BLOCKTIME
+        self.decay = self.BLOCKTIME / self.DECAYTIME
+        self.index = 1
+        self.word = False               # characters pending a word space
+        self.blocks = 0
+        self.time_start = None
+        self.text = []
+
+    def get_wpm(self):
+        return 1.2 / (self.dot * self.BLOCKTIME)
+
+    def get_text(self):
+        # return (char, timestamp) pairs decoded since last call
+        text, self.text = self.text, []
+        return text
+
+    def emit(self, char):
+        timestamp = self.time_start + self.blocks * self.BLOCKTIME
+        self.text.append((char, timestamp))
+
+    def element(self, length):
+        # classify a key down and track speed (a dah is three dots)
+        if length < 2 * self.dot:
+            self.index = 2*self.index
+            self.dot += self.WEIGHT * (length - self.dot)
+        else:
+            self.index = 2*self.index + 1
+            self.dot += self.WEIGHT * (length / 3.0 - self.dot)
+        if self.index >= len(morsetree): self.index = 0
+
+    def gap(self, length):
+        # end character after 2 dots of silence, add a word space after 5
+        if self.index != 1 and length >= 2 * self.dot:
+            if self.index: self.emit(morsetree[self.index] or '*')
+            self.index = 1
+            self.word = True
+        if self.word and length >= 5 * self.dot:
+            self.emit(' ')
+            self.word = False
+
+    def detect(self, power, energy=None):
+        # update keying with the Goertzel power of a block, also called
+        # from a shared analyzer.Analyzer
+        now = time.time()
+        if self.time_start is None or \
+                now - self.MAXSKEW > self.time_start + self.blocks * self.BLOCKTIME:
+            # first block or audio was skipped (no carrier, idle gate)
+            self.time_start = now - self.blocks * self.BLOCKTIME
+        level = math.sqrt(power) / (self.blocksize / 2.0 * self.samplemax)
+        threshold = (self.high + self.low) / 2.0
+        if level > threshold: self.high += self.WEIGHT * (level - self.high)
+        else:
+            self.low += self.WEIGHT * (level - self.low)
+            # fade a strong station's level so weaker ones key again
+            self.high += self.decay * (self.low - self.high)
+        self.high = max(self.high, level)
+        key = level > threshold and level > self.MINLEVEL and level > self.SNR * self.low
+        self.blocks += 1
+        if key == self.keydown:
+            self.length += 1
+            if not key: self.gap(self.length)
+            return
+        if self.keydown: self.element(self.length)
+        self.keydown = key
+        self.length = 1
+
+    def decode_buffer(self, buffer):
+        length = len(self.window)
+        position, total = 0, len(buffer)
+        while position < total:
+            count = min(total - position, length - self.fill)
+            self.window[self.fill:self.fill+count] = buffer[position:position+count]
+            self.fill += count
+            position += count
+            if self.fill < length: break
+            self.fill = 0
+            s_prev = s_prev2 = 0.0
+            for sample in struct.unpack_from(self.format, self.window):
+                s = sample + self.coeff * s_prev - s_prev2
+                s_prev2, s_prev = s_prev, s
+            self.detect(s_prev*s_prev + s_prev2*s_prev2 - self.coeff*s_prev*s_prev2)
+
+
+
 # CS decode
 
 # http://www.ece.uci.edu/~jhahn/python/DTMF.pyc
@@ -35,23 +35,45 @@ CTCSS_FREQS =[67.0, 69.3, 71.9, 74.4, 77.0, 79.7, 82.5, 85.4, 88.5, 91.5, 94.8,
 
 #########################
 class Generator:
+	# Relative frequency error allowed to cache a whole number of cycles
+	MAXERROR = 1e-5
+
 	#########################
 	def __init__(self, samplerate, samplewidth):
 		self.samplerate = samplerate
 		self.samplewidth = samplewidth
 		self.sinindex = 0
 		self.samplemax = 2.0**(8*samplewidth) / 2.0
+		self.table = ""
+		self.table_tone = None
 
 	#########################
-	def generate(self, length, amplitude, freq):
-		start = self.sinindex
-		nbuffer = length
-		anbuffer = nbuffer / self.samplewidth
+	def get_table(self, amplitude, freq):
+		"""Return the packed tone for a whole number of cycles (cached)"""
+		if self.table_tone == (amplitude, freq): return self.table
+		for cycles in xrange(1, int(freq*10) + 1):
+			length = cycles * float(self.samplerate) / freq
+			if abs(length - round(length)) < self.MAXERROR * length: break
+		length = int(round(length))
 		ctcss_signal = [self.samplemax*amplitude*math.sin(2*math.pi*freq*x/self.samplerate) \
-			for x in range(start, start+anbuffer)]
-		self.sinindex += anbuffer
-		format = "<%dh" %anbuffer
-		return struct.pack(format, *ctcss_signal)
+			for x in range(length)]
+		self.table = struct.pack("<%dh" %length, *ctcss_signal)
+		self.table_tone = (amplitude, freq)
+		self.sinindex %= length
+		return self.table
+
+	#########################
+	def generate(self, length, amplitude, freq):
+		table = self.get_table(amplitude, freq)
+		start = (self.sinindex * self.samplewidth) % len(table)
+		self.sinindex = (self.sinindex + length / self.samplewidth) % (len(table) / self.samplewidth)
+		chunks = []
+		while length > 0:
+			chunk = table[start:start+length]
+			chunks.append(chunk)
+			length -= len(chunk)
+			start = 0
+		return "".join(chunks)
 
 #########################
 class Decoder:
@@ -79,13 +101,20 @@ class Decoder:
 		self.threshold = self.SUBWINDOW
 		self.windowsize = int((float(samplerate)*mintime) / self.threshold)
 		self.samplemax = 2.0**(8*samplewidth) / 2.0
-		self.buffer = ""
+		self.window = bytearray(self.windowsize * samplewidth)
+		self.format = "%d%s" %(self.windowsize, self.SAMPLEFORMAT[samplewidth])
+		self.fill = 0
 		self.tone_detected = self.tone_current = None
 		self.ntone = 0
 		self.upfactor = self.UPFACTOR
 		self.downfactor = self.DOWNFACTOR
+		# Built on first decode_buffer, analyzer.Analyzer has its own tables
 		self.cosarray = {}
 		self.sinarray = {}
+
+	#########################
+	def make_tables(self):
+		"""Build the correlation tables used by decode_buffer"""
 		for freq in self.detect_tones:
 			k = 2*math.pi*freq/self.samplerate
 			self.sinarray[freq] = numarray.array([math.sin(k*x) for x in xrange(self.windowsize)])
@@ -101,50 +130,65 @@ class Decoder:
 
 	#########################
 	def decode_buffer(self, buffer):
-		self.buffer += buffer
-		length = self.samplewidth * self.windowsize
-		format = self.SAMPLEFORMAT[self.samplewidth]
-		while len(self.buffer) >= length: 
-			buffer = self.buffer[:length]
-			self.buffer = self.buffer[length:]			
-			window = numarray.array(struct.unpack("%d%s" %(len(buffer)/self.samplewidth, format), buffer))
-			out = []
+		if not self.sinarray: self.make_tables()
+		# Fill the preallocated window, no string concatenation
+		length = len(self.window)
+		position, total = 0, len(buffer)
+		while position < total:
+			count = min(total - position, length - self.fill)
+			self.window[self.fill:self.fill+count] = buffer[position:position+count]
+			self.fill += count
+			position += count
+			if self.fill < length: break
+			self.fill = 0
+			window = numarray.array(struct.unpack_from(self.format, self.window))
+			powers = []
 			for freq in self.detect_tones:
 				value = ((((self.sinarray[freq] * window)).sum())**2 + (((self.cosarray[freq] * window)).sum())**2)
-				out.append((value, freq))
-			out.sort()
-			out.reverse()
-			maxpower, freq = out[0]
-			
-			meanused = self.MEANFREQSUSED
-			meanpower = 0
-			for value in [x[0] for x in out[-meanused:]]:
-				meanpower += value
-			meanpower = math.sqrt(meanpower/meanused) / (self.windowsize * self.samplemax)
-			maxpower = math.sqrt(maxpower) / (self.windowsize * self.samplemax)
-			if meanpower < 0.0000000001:
-				overpower = 10*self.OVERPOWER
-			else: overpower = maxpower / meanpower
-			
-			#print "debug: %f, %f, %f, %f, %d, %d" %(maxpower, meanpower, overpower, freq, self.windowsize, self.threshold)
-			mindiff = CTCSS_FREQS[-1]
-			for f in self.detect_tones:
-				diff = abs(freq - f)
-				if diff < mindiff:
-					mindiff = diff
-					ctcssfreq = f
-				else: break
-			if maxpower > self.MINPOWER and overpower > self.OVERPOWER and self.tone_current == ctcssfreq:
-				self.ntone += self.upfactor
-				if self.ntone >= self.threshold:
-					self.ntone = self.threshold
-					self.tone_detected = ctcssfreq
-			else:
-				self.ntone -= self.downfactor
-				if self.ntone < 0:
-					self.tone_current = ctcssfreq
-					self.ntone = self.upfactor
-					self.tone_detected = None
+				powers.append(value)
+			self.detect(powers)
+
+	#########################
+	def detect(self, powers):
+		"""Update tone detection with the correlation power of a window.
+		
+		<powers> holds a value for each frequency in detect_tones, it may 
+		come from decode_buffer or from a shared analyzer.Analyzer.
+		"""
+		out = zip(powers, self.detect_tones)
+		out.sort()
+		out.reverse()
+		maxpower, freq = out[0]
+		
+		meanused = self.MEANFREQSUSED
+		meanpower = 0
+		for value in [x[0] for x in out[-meanused:]]:
+			meanpower += value
+		meanpower = math.sqrt(meanpower/meanused) / (self.windowsize * self.samplemax)
+		maxpower = math.sqrt(maxpower) / (self.windowsize * self.samplemax)
+		if meanpower < 0.0000000001:
+			overpower = 10*self.OVERPOWER
+		else: overpower = maxpower / meanpower
+		
+		#print "debug: %f, %f, %f, %f, %d, %d" %(maxpower, meanpower, overpower, freq, self.windowsize, self.threshold)
+		mindiff = CTCSS_FREQS[-1]
+		for f in self.detect_tones:
+			diff = abs(freq - f)
+			if diff < mindiff:
+				mindiff = diff
+				ctcssfreq = f
+			else: break
+		if maxpower > self.MINPOWER and overpower > self.OVERPOWER and self.tone_current == ctcssfreq:
+			self.ntone += self.upfactor
+			if self.ntone >= self.threshold:
+				self.ntone = self.threshold
+				self.tone_detected = ctcssfreq
+		else:
+			self.ntone -= self.downfactor
+			if self.ntone < 0:
+				self.tone_current = ctcssfreq
+				self.ntone = self.upfactor
+				self.tone_detected = None
 
 
 ###########################
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+
+# Out-of-process CTCSS/DTMF decoding for RepeaterPi
+#
+# Captured audio is copied into a shared memory ring and decoded in a
+# forked process, so tone decoding never holds the interpreter lock while
+# the soundcard is being read. Results come back as text lines on a pipe.
+
+# Standard Python modules
+import os, sys, time, traceback
+import mmap, struct, fcntl, errno
+
+#########################
+class Worker:
+	"""Decode CTCSS tones and DTMF keys in a separate process.
+
+	Offers the same interface as ctcss.Decoder (decode_buffer, get_tone,
+	clear_tone) and dtmf.Decoder (get_digits), so Radio can use it in place
+	of the in-process decoders. If the worker process dies, <alive> turns
+	False and the worker stops accepting audio (see Radio.check_dsp_worker).
+	"""
+	RINGTIME = 2.0
+	NICE = 5
+	DOORBELL = "<cQ"
+
+	#########################
+	def __init__(self, samplerate, samplewidth, ctcss_mintime=None, dtmf=False, \
+		verbose=False):
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.ctcss_mintime = ctcss_mintime
+		self.dtmf = dtmf
+		self.verbose = verbose
+		self.ringsize = int(samplerate * samplewidth * self.RINGTIME)
+		self.ring = mmap.mmap(-1, self.ringsize)
+		self.written = 0
+		self.tone = self.tone_time = None
+		self.digits = []
+		self.results = ""
+		self.msgsize = struct.calcsize(self.DOORBELL)
+		self.alive = True
+
+		doorbell_read, self.doorbell = os.pipe()
+		self.channel, channel_write = os.pipe()
+		self.pid = os.fork()
+		if not self.pid:
+			os.close(self.doorbell)
+			os.close(self.channel)
+			status = 0
+			try:
+				try: self.run(doorbell_read, channel_write)
+				except KeyboardInterrupt: pass
+				except:
+					sys.stderr.write("dspworker -- worker failed:\n")
+					traceback.print_exc()
+					sys.stderr.flush()
+					status = 1
+			finally: os._exit(status)
+		os.close(doorbell_read)
+		os.close(channel_write)
+		for fd in (self.doorbell, self.channel):
+			flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+			fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+		self.debug("started (pid %d)" %self.pid)
+
+	###################################
+	def debug(self, args):
+		"""Write logs to standard error if enabled"""
+		if not self.verbose: return
+		sys.stderr.write("dspworker -- " + str(args) + "\n")
+		sys.stderr.flush()
+
+	#########################
+	def died(self, reason):
+		"""Mark the worker process as dead (logged once)"""
+		if not self.alive: return
+		self.alive = False
+		self.tone = None
+		self.debug("worker process died: %s" %reason)
+
+	#########################
+	def notify(self, command, value=0):
+		"""Send a command to the worker (never blocks)"""
+		if not self.alive: return
+		try: os.write(self.doorbell, struct.pack(self.DOORBELL, command, value))
+		except OSError, (nerror, detail):
+			if nerror in (errno.EPIPE, errno.ECONNRESET): self.died(detail)
+			elif nerror != errno.EAGAIN: raise
+
+	#########################
+	def decode_buffer(self, buffer):
+		"""Copy audio into the shared ring and wake the worker"""
+		if not self.alive: return
+		length = len(buffer)
+		if length > self.ringsize:
+			buffer = buffer[-self.ringsize:]
+			self.written += length - self.ringsize
+			length = self.ringsize
+		start = self.written % self.ringsize
+		first = min(length, self.ringsize - start)
+		self.ring[start:start+first] = buffer[:first]
+		if first < length: self.ring[:length-first] = buffer[first:]
+		self.written += length
+		self.notify("d", self.written)
+
+	#########################
+	def poll(self):
+		"""Read pending results (non-blocking)"""
+		while self.alive:
+			try: data = os.read(self.channel, 4096)
+			except OSError, (nerror, detail):
+				if nerror == errno.EAGAIN: break
+				if nerror != errno.ECONNRESET: raise
+				self.died(detail)
+				break
+			if not data:
+				self.died("end of results pipe")
+				break
+			self.results += data
+		if "\n" not in self.results: return
+		lines = self.results.split("\n")
+		self.results = lines.pop()
+		for line in lines:
+			kind, value, timestamp = line.split()
+			if kind == "ctcss":
+				self.tone = (value != "None" and float(value)) or None
+				self.tone_time = float(timestamp)
+			elif kind == "dtmf":
+				self.digits.append((value, float(timestamp)))
+
+	#########################
+	def get_tone(self):
+		self.poll()
+		return self.tone
+
+	#########################
+	def clear_tone(self):
+		self.tone = None
+		self.notify("c")
+
+	#########################
+	def get_digits(self):
+		"""Return DTMF keys detected since last call"""
+		self.poll()
+		digits = "".join([x[0] for x in self.digits])
+		self.digits = []
+		return digits
+
+	#########################
+	def get_digit_events(self):
+		"""Return (key, timestamp) pairs detected since last call"""
+		self.poll()
+		digits, self.digits = self.digits, []
+		return digits
+
+	#########################
+	def close(self):
+		"""Stop the worker process"""
+		if not self.pid: return
+		self.notify("q")
+		os.close(self.doorbell)
+		try: os.waitpid(self.pid, 0)
+		except OSError: pass
+		os.close(self.channel)
+		self.pid = None
+		self.debug("stopped")
+
+	#########################
+	def run(self, doorbell, channel):
+		"""Worker loop (child process)"""
+		try: os.nice(self.NICE)
+		except OSError: pass
+		import analyzer
+		spectrum = analyzer.Analyzer(self.samplerate, self.samplewidth)
+		ctcss_decoder = dtmf_decoder = None
+		if self.ctcss_mintime:
+			import ctcss
+			ctcss_decoder = ctcss.Decoder(self.samplerate, self.samplewidth, self.ctcss_mintime)
+			spectrum.add_ctcss(ctcss_decoder)
+		if self.dtmf:
+			import dtmf
+			dtmf_decoder = dtmf.Decoder(self.samplerate, self.samplewidth)
+			spectrum.add_dtmf(dtmf_decoder)
+
+		position = 0
+		pending = ""
+		tone = None
+		while 1:
+			data = pending + os.read(doorbell, self.msgsize * 256)
+			if len(data) == len(pending): break
+			nmsgs = len(data) / self.msgsize
+			pending = data[nmsgs*self.msgsize:]
+			written = None
+			for index in range(nmsgs):
+				command, value = struct.unpack_from(self.DOORBELL, data, index*self.msgsize)
+				if command == "q": return
+				elif command == "c" and ctcss_decoder:
+					ctcss_decoder.clear_tone()
+					tone = None
+				elif command == "d": written = value
+			if written is None: continue
+
+			# Keep half a ring of margin from the writer, drop older audio
+			if written - position > self.ringsize / 2:
+				position = written - self.ringsize / 2
+			start, end = position % self.ringsize, written % self.ringsize
+			if start <= end: buffer = self.ring[start:end]
+			else: buffer = self.ring[start:] + self.ring[:end]
+			position = written
+			now = time.time()
+
+			spectrum.feed(buffer)
+			lines = []
+			if ctcss_decoder:
+				if ctcss_decoder.get_tone() != tone:
+					tone = ctcss_decoder.get_tone()
+					lines.append("ctcss %s %f\n" %(tone, now))
+			if dtmf_decoder:
+				for key in dtmf_decoder.get_digits():
+					lines.append("dtmf %s %f\n" %(key, now))
+			if lines: os.write(channel, "".join(lines))
@@ -96,6 +96,91 @@ class pygoertzel_dtmf:
                 self.totalpower[freq] = 1
             freqs[freq] = power / self.totalpower[freq] / self.N[freq]
         return self.__get_number(freqs)
+class Decoder:
+    '''
+    Streaming DTMF decoder with the same interface as ctcss.Decoder.
+    Audio is split into bins of BINTIME seconds; a key is reported once
+    it has been detected on MINBINS consecutive bins and the tone pair
+    holds at least MINRATIO of the bin energy.
+    '''
+    BINTIME = 0.025
+    MINPOWER = 0.01
+    MINRATIO = 0.5
+    MINBINS = 2
+    SAMPLEFORMAT = {1: "b", 2: "h"}
+    LOWFREQS = [697.0,770.0,852.0,941.0]
+    HIGHFREQS = [1209.0,1336.0,1477.0,1633.0]
+    KEYS = ["123A", "456B", "789C", "*0#D"]
+    def __init__(self, samplerate=8000, samplewidth=2):
+        if samplewidth not in self.SAMPLEFORMAT:
+            raise ValueError, "Invalid sample width: %s" %samplewidth
+        self.samplerate = samplerate
+        self.samplewidth = samplewidth
+        self.samplemax = 2.0**(8*samplewidth) / 2.0
+        self.binsize = int(samplerate * self.BINTIME)
+        self.format = "<%d%s" %(self.binsize, self.SAMPLEFORMAT[samplewidth])
+        self.window = bytearray(self.binsize * samplewidth)
+        self.fill = 0
+        self.coeffs = [(freq, 2.0*math.cos(2.0*math.pi*freq/samplerate)) \
+            for freq in self.LOWFREQS + self.HIGHFREQS]
+        self.digits = ""
+        self.key_current = None
+        self.nbins = 0
+    def get_digits(self):
+        # return keys detected since last call
+        digits, self.digits = self.digits, ""
+        return digits
+    def clear_digits(self):
+        self.digits = ""
+        self.key_current = None
+        self.nbins = 0
+    def analyse(self, window):
+        # return goertzel power for every frequency and the bin energy
+        samples = struct.unpack_from(self.format, window)
+        energy = float(sum([sample*sample for sample in samples]))
+        powers = {}
+        for freq, coeff in self.coeffs:
+            s_prev = s_prev2 = 0.0
+            for sample in samples:
+                s = sample + coeff * s_prev - s_prev2
+                s_prev2, s_prev = s_prev, s
+            powers[freq] = s_prev*s_prev + s_prev2*s_prev2 - coeff*s_prev*s_prev2
+        return self.normalize(powers, energy)
+    def normalize(self, powers, energy):
+        # normalize powers to the bin energy (a pure tone gives 1.0), None if too weak.
+        # powers may come from analyse or from a shared analyzer.Analyzer
+        if energy / self.binsize < (self.MINPOWER * self.samplemax)**2:
+            return
+        for freq in powers:
+            powers[freq] = powers[freq] / (energy * self.binsize / 2.0)
+        return powers
+    def get_key(self, powers):
+        # return key for the strongest low/high pair if it dominates the bin
+        if not powers: return
+        low = max([(powers[f], f) for f in self.LOWFREQS])
+        high = max([(powers[f], f) for f in self.HIGHFREQS])
+        if low[0] + high[0] < self.MINRATIO: return
+        return self.KEYS[self.LOWFREQS.index(low[1])][self.HIGHFREQS.index(high[1])]
+    def detect(self, powers):
+        key = self.get_key(powers)
+        if key != self.key_current:
+            self.key_current = key
+            self.nbins = 0
+        self.nbins += 1
+        if key and self.nbins == self.MINBINS:
+            self.digits += key
+    def decode_buffer(self, buffer):
+        # fill the preallocated bin, no string concatenation
+        length = len(self.window)
+        position, total = 0, len(buffer)
+        while position < total:
+            count = min(total - position, length - self.fill)
+            self.window[self.fill:self.fill+count] = buffer[position:position+count]
+            self.fill += count
+            position += count
+            if self.fill < length: break
+            self.fill = 0
+            self.detect(self.analyse(self.window))
 if __name__ == '__main__':
     # load wav file
     wav = wave.open('/home/michael/Downloads/dtmf.wav', 'r')
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+# Idle-aware duty cycling of the tone decoders for RepeaterPi
+#
+# While the channel is idle only a cheap energy check (audioop.rms) runs on
+# every buffer. Recent buffers are kept as pre-trigger history, so when
+# activity appears the decoders get the start of the transmission too and
+# no detection latency is lost. Radio uses it only without carrier detection;
+# with it, decoders already run only while carrier is on.
+
+# Standard Python modules
+import time, audioop
+
+#########################
+class IdleGate:
+	"""Run decoders only when the channel is active.
+
+	threshold -- Power (fraction of full scale) considered activity
+	pretrigger -- Seconds of audio replayed to the decoders on wake up
+	hangtime -- Seconds of inactivity before going back to idle
+	"""
+	WEIGHT = 0.05
+
+	#########################
+	def __init__(self, samplerate, samplewidth, threshold=0.01, pretrigger=0.3, \
+		hangtime=2.0):
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.samplemax = 2.0**(8*samplewidth) / 2.0
+		self.threshold = threshold
+		self.pretrigger = int(pretrigger * samplerate * samplewidth)
+		self.hangtime = int(hangtime * samplerate * samplewidth)
+		self.history = []
+		self.history_size = 0
+		self.active = False
+		self.inactive = 0
+		self.decoded = self.skipped = 0
+		self.decode_cost = 0.0
+		self.gate_time = self.decode_time = 0.0
+
+	#########################
+	def process(self, buffer, carrier, decode):
+		"""Call decode(buffer) only if the channel is active. Return True if
+		the decoders run.
+
+		Activity is the <carrier> state; with no carrier source (<carrier>
+		is None) the buffer power is compared against the threshold.
+		"""
+		start = time.time()
+		if carrier is None:
+			carrier = audioop.rms(buffer, self.samplewidth) / self.samplemax >= self.threshold
+		if carrier:
+			self.inactive = 0
+			if not self.active:
+				self.active = True
+				self.history.append(str(buffer))
+				buffer = "".join(self.history)
+				self.skipped -= self.history_size
+				self.history, self.history_size = [], 0
+		elif self.active:
+			self.inactive += len(buffer)
+			if self.inactive >= self.hangtime: self.active = False
+
+		if not self.active:
+			# Copy buffer() views, their memory is reused by the caller
+			self.history.append(str(buffer))
+			self.history_size += len(buffer)
+			while self.history_size - len(self.history[0]) >= self.pretrigger:
+				self.history_size -= len(self.history.pop(0))
+			self.skipped += len(buffer)
+			self.gate_time += time.time() - start
+			return False
+
+		decode_start = time.time()
+		decode(buffer)
+		now = time.time()
+		self.gate_time += decode_start - start
+		self.decode_time += now - decode_start
+		self.decoded += len(buffer)
+		cost = (now - decode_start) / len(buffer)
+		if not self.decode_cost: self.decode_cost = cost
+		else: self.decode_cost += self.WEIGHT * (cost - self.decode_cost)
+		return True
+
+	#########################
+	def get_report(self):
+		"""Return a dictionary with duty cycle statistics.
+
+		duty -- Fraction of the audio that went through the decoders
+		cpu_saved -- Estimated decoder time saved (seconds), net of gate time,
+		             against decoding every buffer (the only way to decode 
+		             without carrier detection)
+		cpu_saved_ratio -- Saved time over the time a full decode would need
+		"""
+		total = self.decoded + self.skipped
+		full = self.decode_cost * total
+		saved = self.decode_cost * self.skipped - self.gate_time
+		report = {"active": self.active, "duty": None, "cpu_saved": saved, \
+			"cpu_saved_ratio": None}
+		if total: report["duty"] = float(self.decoded) / total
+		if full: report["cpu_saved_ratio"] = saved / full
+		return report
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+# Activity history for the RepeaterPi console and web interface
+#
+# Two fixed size rings backed by array.array (bounded memory, no per-event
+# objects): timestamped events (carrier, PTT, tones, DTMF keys, timeouts)
+# and per-second channel metrics (carrier and PTT time, peak level,
+# timeouts). Range queries use bisect on the time column.
+
+# Standard Python modules
+import os, time, array, bisect
+import marshal, threading, audioop
+
+EVENTS = {"carrier": 1, "ptt": 2, "ctcss": 3, "dtmf": 4, "timeout": 5}
+EVENT_NAMES = dict([(code, name) for name, code in EVENTS.items()])
+
+#########################
+class Column:
+	"""Sequence view (oldest first) of a ring column, usable with bisect"""
+	#########################
+	def __init__(self, ring, data):
+		self.ring = ring
+		self.data = data
+
+	#########################
+	def __len__(self):
+		return self.ring.count
+
+	#########################
+	def __getitem__(self, index):
+		return self.data[self.ring.position(index)]
+
+#########################
+class Ring:
+	"""Fixed size ring of records stored in parallel arrays (columns)"""
+	#########################
+	def __init__(self, size, typecodes):
+		self.size = size
+		self.columns = [array.array(code, [0]) * size for code in typecodes]
+		self.head = 0
+		self.count = 0
+
+	#########################
+	def position(self, index):
+		"""Array position of the <index>th oldest record"""
+		return (self.head - self.count + index) % self.size
+
+	#########################
+	def append(self, *values):
+		for column, value in zip(self.columns, values):
+			column[self.head] = value
+		self.head = (self.head + 1) % self.size
+		if self.count < self.size: self.count += 1
+
+	#########################
+	def column(self, index):
+		return Column(self, self.columns[index])
+
+	#########################
+	def range(self, start, end):
+		"""Return (first, last) record indexes with time (column 0) in [start, end)"""
+		times = self.column(0)
+		return bisect.bisect_left(times, start), bisect.bisect_left(times, end)
+
+	#########################
+	def records(self, first, last):
+		for index in xrange(first, last):
+			position = self.position(index)
+			yield tuple([column[position] for column in self.columns])
+
+	#########################
+	def dump(self):
+		"""Return columns as strings, oldest first"""
+		start = self.position(0)
+		output = []
+		for column in self.columns:
+			if start + self.count <= self.size: data = column[start:start+self.count]
+			else: data = column[start:] + column[:self.head]
+			output.append(data.tostring())
+		return output
+
+	#########################
+	def restore(self, columns):
+		for column, data in zip(self.columns, columns):
+			values = array.array(column.typecode)
+			values.fromstring(data)
+			values = values[-self.size:]
+			column[:len(values)] = values
+			self.count = len(values)
+		self.head = self.count % self.size
+
+#########################
+class History:
+	"""Activity store for carrier, PTT, tones and channel levels.
+
+	events -- Maximum number of events kept
+	seconds -- Seconds of per-second metrics kept
+	snapshot -- Path of the periodic snapshot (None disables it)
+	"""
+	#########################
+	def __init__(self, samplerate, samplewidth, events=10000, seconds=86400, \
+		snapshot=None, snapshot_interval=300):
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.samplemax = 2.0**(8*samplewidth) / 2.0
+		# time, event code, value
+		self.events = Ring(events, "dBd")
+		# second, carrier time, PTT time, peak level, timeouts
+		self.metrics = Ring(seconds, "dfffH")
+		self.state = {"carrier": False, "ptt": False}
+		self.second = None
+		self.carrier_time = self.ptt_time = self.peak = 0.0
+		self.timeouts = 0
+		self.snapshot_path = snapshot
+		self.snapshot_interval = snapshot_interval
+		self.time_snapshot = time.time()
+		if snapshot and os.path.exists(snapshot): self.load(snapshot)
+
+	#########################
+	def event(self, name, value=1, now=None):
+		"""Record an event (see EVENTS) with a numeric value"""
+		if now is None: now = time.time()
+		if name in self.state: self.state[name] = bool(value)
+		if name == "timeout": self.timeouts += 1
+		self.events.append(now, EVENTS[name], float(value))
+
+	#########################
+	def audio(self, buffer, now=None):
+		"""Account a received buffer in the per-second metrics"""
+		if now is None: now = time.time()
+		second = int(now)
+		if second != self.second:
+			self.flush()
+			self.second = second
+		duration = float(len(buffer)) / (self.samplerate * self.samplewidth)
+		if self.state["carrier"]: self.carrier_time += duration
+		if self.state["ptt"]: self.ptt_time += duration
+		peak = audioop.max(buffer, self.samplewidth) / self.samplemax
+		if peak > self.peak: self.peak = peak
+		if self.snapshot_path and now - self.time_snapshot >= self.snapshot_interval:
+			self.time_snapshot = now
+			self.snapshot()
+
+	#########################
+	def flush(self):
+		"""Store the metrics of the current second"""
+		if self.second is None: return
+		self.metrics.append(self.second, min(1.0, self.carrier_time), \
+			min(1.0, self.ptt_time), self.peak, self.timeouts)
+		self.carrier_time = self.ptt_time = self.peak = 0.0
+		self.timeouts = 0
+
+	#########################
+	def get_events(self, start, end=None, names=None):
+		"""Return (time, name, value) events in [start, end)"""
+		if end is None: end = time.time() + 1
+		first, last = self.events.range(start, end)
+		output = []
+		for timestamp, code, value in self.events.records(first, last):
+			name = EVENT_NAMES[code]
+			if names and name not in names: continue
+			output.append((timestamp, name, value))
+		return output
+
+	#########################
+	def get_metrics(self, start, end=None, step=60):
+		"""Return metrics in [start, end) aggregated every <step> seconds.
+
+		Each item is a dictionary with: time (start of the step), carrier
+		and ptt (fraction of time on), peak (max level) and timeouts.
+		"""
+		if end is None: end = time.time() + 1
+		first, last = self.metrics.range(start, end)
+		output = []
+		current = None
+		for second, carrier, ptt, peak, timeouts in self.metrics.records(first, last):
+			bucket = second - (second - start) % step
+			if not current or current["time"] != bucket:
+				current = {"time": bucket, "carrier": 0.0, "ptt": 0.0, \
+					"peak": 0.0, "timeouts": 0}
+				output.append(current)
+			current["carrier"] += carrier / step
+			current["ptt"] += ptt / step
+			current["peak"] = max(current["peak"], peak)
+			current["timeouts"] += timeouts
+		return output
+
+	#########################
+	def snapshot(self, path=None):
+		"""Write history to disk (in a thread, from a copy of the rings)"""
+		path = path or self.snapshot_path
+		data = {"events": self.events.dump(), "metrics": self.metrics.dump()}
+		thread = threading.Thread(target=self.write, args=(path, data))
+		thread.setDaemon(True)
+		thread.start()
+		return thread
+
+	#########################
+	def write(self, path, data):
+		temporal = path + ".tmp"
+		fd = open(temporal, "wb")
+		try: marshal.dump(data, fd)
+		finally: fd.close()
+		os.rename(temporal, path)
+
+	#########################
+	def load(self, path):
+		"""Restore history from a snapshot"""
+		fd = open(path, "rb")
+		try: data = marshal.load(fd)
+		finally: fd.close()
+		self.events.restore(data["events"])
+		self.metrics.restore(data["metrics"])
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+# Conference mixer for linked repeaters
+#
+# Inbound streams (local receivers and remote links) are summed once per
+# frame, and every destination gets the sum minus its own audio so a site
+# never hears itself. All arithmetic runs in audioop over whole frames:
+# samples are widened to 32 bits to sum without overflow and saturated
+# back to 16 bits on output.
+
+# Standard Python modules
+import audioop
+
+#########################
+class Conference:
+	"""Mix-minus conference for N audio streams.
+
+	Call write() with a frame for every stream that has audio, then mix()
+	to get the outgoing frame for every stream. Streams without audio in
+	a round still receive the mix of the others.
+	"""
+	# Headroom bits kept when widening 16 bit samples to 32 bits
+	HEADROOM = 8
+
+	#########################
+	def __init__(self, samplewidth=2):
+		if samplewidth != 2:
+			raise ValueError, "Invalid sample width: %s" %samplewidth
+		self.samplewidth = samplewidth
+		self.streams = {}
+		self.frames = {}
+		self.widen = 1.0 / 2**self.HEADROOM
+		self.narrow = float(2**self.HEADROOM)
+
+	#########################
+	def add_stream(self, name, gain=1.0):
+		"""Add a stream (local receiver or link) to the conference"""
+		self.streams[name] = gain
+
+	#########################
+	def remove_stream(self, name):
+		if name in self.streams: del self.streams[name]
+		if name in self.frames: del self.frames[name]
+
+	#########################
+	def set_gain(self, name, gain):
+		self.streams[name] = gain
+
+	#########################
+	def write(self, name, buffer):
+		"""Set the inbound frame of a stream for the next mix"""
+		if name not in self.streams:
+			raise KeyError, "Unknown stream: %s" %name
+		self.frames[name] = buffer
+
+	#########################
+	def mix(self, length):
+		"""Return a dictionary with the mix-minus frame (<length> bytes) for
+		every stream, and clear inbound frames."""
+		nsamples = length / self.samplewidth
+		total = "\x00" * (nsamples * 4)
+		wide = {}
+		for name, buffer in self.frames.items():
+			if len(buffer) < length: buffer += "\x00" * (length - len(buffer))
+			elif len(buffer) > length: buffer = buffer[:length]
+			# Sample << 16 in 32 bits, scaled down to keep headroom for the sum
+			buffer = audioop.lin2lin(buffer, self.samplewidth, 4)
+			buffer = audioop.mul(buffer, 4, self.streams[name] * self.widen)
+			wide[name] = buffer
+			total = audioop.add(total, buffer, 4)
+		self.frames = {}
+
+		silence = self.saturate(total)
+		output = {}
+		for name in self.streams:
+			if name not in wide:
+				output[name] = silence
+				continue
+			minus = audioop.add(total, audioop.mul(wide[name], 4, -1), 4)
+			output[name] = self.saturate(minus)
+		return output
+
+	#########################
+	def saturate(self, buffer):
+		"""Convert a 32 bit sum back to 16 bit samples, clipping on overflow"""
+		buffer = audioop.mul(buffer, 4, self.narrow)
+		return audioop.lin2lin(buffer, 4, self.samplewidth)
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+# Live spectrum and level monitor for RepeaterPi
+#
+# Radio taps received and sent audio into the monitor (a cheap append).
+# A single producer thread computes, once per interval, a decimated FFT
+# frame, peak/RMS levels and the current carrier/PTT/CTCSS state, and
+# serialises it to JSON into a shared ring. Any number of clients (HTTP
+# Server-Sent Events or a Unix socket) read the ring, so the cost per
+# client is only sending the already serialised frame.
+
+# Standard Python modules
+import sys, os, time, math
+import audioop, json, socket, threading
+import BaseHTTPServer, SocketServer
+import numarray, numarray.fft
+
+#########################
+class Monitor:
+	"""Compute monitor frames and publish them to subscribers.
+
+	interval -- Seconds between frames
+	fftsize -- Samples analysed per frame (most recent audio)
+	bins -- Spectrum bins sent per frame (FFT bins are max-pooled)
+	ringsize -- Frames kept for slow clients
+	"""
+	MINLEVEL = -90.0
+	# Buffers kept per direction if the producer thread falls behind
+	MAXPENDING = 256
+
+	#########################
+	def __init__(self, samplerate, samplewidth, interval=0.2, fftsize=512, \
+		bins=64, ringsize=32, verbose=False):
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.samplemax = 2.0**(8*samplewidth) / 2.0
+		self.interval = interval
+		self.fftsize = fftsize
+		self.bins = bins
+		self.verbose = verbose
+		self.ring = [None] * ringsize
+		self.sequence = 0
+		self.condition = threading.Condition()
+		self.pending = {"rx": [], "tx": []}
+		self.state = {"carrier": False, "ptt": False, "ctcss": None}
+		self.window = numarray.array([0.5 - 0.5*math.cos(2*math.pi*x/fftsize) \
+			for x in xrange(fftsize)])
+		self.servers = []
+		self.running = False
+
+	###################################
+	def debug(self, args):
+		"""Write logs to standard error if enabled"""
+		if not self.verbose: return
+		sys.stderr.write("monitor -- " + str(args) + "\n")
+		sys.stderr.flush()
+
+	#########################
+	def tap(self, direction, buffer):
+		"""Add audio of a direction ("rx" or "tx"), called from the audio loop"""
+		if not self.running: return
+		pending = self.pending[direction]
+		pending.append(buffer)
+		if len(pending) > self.MAXPENDING: del pending[0]
+
+	#########################
+	def set_state(self, name, value):
+		self.state[name] = value
+
+	#########################
+	def levels(self, buffer):
+		"""Return (peak, rms) in dBFS"""
+		if not buffer: return self.MINLEVEL, self.MINLEVEL
+		peak = audioop.max(buffer, self.samplewidth) / self.samplemax
+		rms = audioop.rms(buffer, self.samplewidth) / self.samplemax
+		return self.decibels(peak), self.decibels(rms)
+
+	#########################
+	def decibels(self, value):
+		if value <= 0: return self.MINLEVEL
+		return max(self.MINLEVEL, round(20*math.log10(value), 1))
+
+	#########################
+	def spectrum(self, buffer):
+		"""Return max-pooled FFT magnitudes (dBFS) of the last fftsize samples"""
+		length = self.fftsize * self.samplewidth
+		buffer = buffer[-length:]
+		if len(buffer) < length: buffer = "\x00" * (length - len(buffer)) + buffer
+		samples = numarray.fromstring(buffer, numarray.Int16) * self.window
+		magnitude = abs(numarray.fft.real_fft(samples))
+		scale = self.fftsize * self.samplemax / 4.0
+		step = len(magnitude) / self.bins
+		return [self.decibels(max(magnitude[i*step:(i+1)*step]) / scale) \
+			for i in range(self.bins)]
+
+	#########################
+	def make_frame(self):
+		"""Build a frame with the audio tapped since the last one"""
+		frame = {"time": time.time(), "interval": self.interval, \
+			"samplerate": self.samplerate}
+		frame.update(self.state)
+		for direction in ("rx", "tx"):
+			# Swap lists (atomic), the audio loop keeps appending to the new one
+			buffers, self.pending[direction] = self.pending[direction], []
+			buffer = "".join(buffers)
+			peak, rms = self.levels(buffer)
+			spectrum = None
+			if buffer: spectrum = self.spectrum(buffer)
+			frame[direction] = {"peak": peak, "rms": rms, "spectrum": spectrum}
+		return frame
+
+	#########################
+	def publish(self, frame):
+		"""Serialise a frame once and store it in the ring"""
+		self.condition.acquire()
+		try:
+			self.sequence += 1
+			frame["sequence"] = self.sequence
+			self.ring[self.sequence % len(self.ring)] = (self.sequence, json.dumps(frame))
+			self.condition.notifyAll()
+		finally: self.condition.release()
+
+	#########################
+	def get_frames(self, last, timeout=None):
+		"""Return (sequence, data) frames newer than <last>, waiting if needed"""
+		self.condition.acquire()
+		try:
+			if self.sequence <= last and self.running:
+				self.condition.wait(timeout)
+			# Sequences start at 1, nothing is returned until a frame is published
+			first = max(last + 1, 1, self.sequence - len(self.ring) + 1)
+			return [self.ring[x % len(self.ring)] for x in range(first, self.sequence + 1)]
+		finally: self.condition.release()
+
+	#########################
+	def run(self):
+		"""Producer loop"""
+		next_time = time.time()
+		while self.running:
+			next_time += self.interval
+			try: self.publish(self.make_frame())
+			except Exception, detail: self.debug("cannot build frame: %s" %detail)
+			delay = next_time - time.time()
+			if delay > 0: time.sleep(delay)
+			else: next_time = time.time()
+
+	#########################
+	def start(self, port=None, address="127.0.0.1", unix_socket=None):
+		"""Start producer thread and the HTTP and/or Unix socket endpoints.
+
+		The HTTP endpoint listens on loopback, use address="" for all interfaces.
+		"""
+		self.running = True
+		self.start_thread(self.run)
+		if port is not None:
+			server = HTTPServer((address, port), HTTPHandler)
+			server.monitor = self
+			self.servers.append(server)
+			self.start_thread(server.serve_forever)
+			self.debug("HTTP endpoint on %s:%d" %(address, port))
+		if unix_socket:
+			if os.path.exists(unix_socket): os.unlink(unix_socket)
+			server = UnixServer(unix_socket, UnixHandler)
+			server.monitor = self
+			self.servers.append(server)
+			self.start_thread(server.serve_forever)
+			self.debug("Unix socket endpoint: %s" %unix_socket)
+
+	#########################
+	def start_thread(self, target):
+		thread = threading.Thread(target=target)
+		thread.setDaemon(True)
+		thread.start()
+
+	#########################
+	def stop(self):
+		self.running = False
+		self.pending = {"rx": [], "tx": []}
+		self.condition.acquire()
+		self.condition.notifyAll()
+		self.condition.release()
+		for server in self.servers:
+			server.shutdown()
+			server.server_close()
+		self.servers = []
+
+	#########################
+	def stream(self, write, format):
+		"""Send frames to a client until it disconnects"""
+		last = self.sequence - 1
+		while self.running:
+			for sequence, data in self.get_frames(last, 1.0):
+				write(format %data)
+				last = sequence
+
+#########################
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+#########################
+class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""GET /frame (latest frame) and GET /stream (Server-Sent Events)"""
+	#########################
+	def do_GET(self):
+		monitor = self.server.monitor
+		if self.path == "/frame":
+			frames = monitor.get_frames(monitor.sequence - 1, 0)
+			data = (frames and frames[-1][1]) or "{}"
+			self.send_response(200)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+		elif self.path == "/stream":
+			self.send_response(200)
+			self.send_header("Content-Type", "text/event-stream")
+			self.send_header("Cache-Control", "no-cache")
+			self.end_headers()
+			try: monitor.stream(self.wfile.write, "data: %s\n\n")
+			except socket.error: pass
+		else: self.send_error(404)
+
+	#########################
+	def log_message(self, format, *args):
+		self.server.monitor.debug(format %args)
+
+#########################
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+#########################
+class UnixHandler(SocketServer.StreamRequestHandler):
+	"""Send frames as JSON lines"""
+	#########################
+	def handle(self):
+		try: self.server.monitor.stream(self.wfile.write, "%s\n")
+		except socket.error: pass
@@ -42,10 +42,24 @@ class Radio:
 	converter. Moreover, it allows controlling the PTT (Push-to-Talk) line which
 	toggle between the reception (Rx) or transmition (Tx) state. 
 	"""
+	# Fragment size limits (bytes) for the soundcard
+	MINFRAGMENT = 128
+	MAXFRAGMENT = 32768
+	
+	# Xrun detection and fragment size auto-tuning
+	XRUN_FRAGMENTS = 2
+	AUTOTUNE_XRUNS = 3
+	AUTOTUNE_CLEANTIME = 60
+	AUTOTUNE_HEADROOM = 0.5
+	HEADROOM_WEIGHT = 0.05
+	REOPEN_RETRIES = 3
 
 	###############################
 	def __init__(self, soundcard_device, samplerate, ptt, carrier, verbose=False, \
-		soundcard_retries=1, fullduplex=False, latency=None, ctcss_mintime=False):
+		soundcard_retries=1, fullduplex=False, latency=None, ctcss_mintime=False, \
+		scheduler=None, dtmf_decode=False, dsp_worker=False, idle_decode=False, \
+		monitor=None, cw_decode=None, voice=None, history=None, idle_threshold=0.01, \
+		idle_pretrigger=0.3, idle_hangtime=2.0):
 		"""Open a soundcard and PTT interface.
 		Use radio_control object to set PTT and get carrier-detection state.
 		
@@ -54,43 +68,134 @@ class Radio:
 		
 		PTT object is an instance  of ExecInterface with "on" and "off"
 		commands defined.
+		
+		Scheduler object (scheduler.Scheduler) mixes timed events (IDs, 
+		announcements) into the audio sent to the radio.
+		
+		With <dsp_worker> enabled, CTCSS and DTMF (<dtmf_decode>) decoding 
+		runs in a separate process fed from a shared memory ring. If that
+		process dies, decoding falls back to in-process decoders.
+		
+		Decoders run while carrier is detected. With no carrier detection, 
+		<idle_decode> runs them when audio power is over <idle_threshold>:
+		they get <idle_pretrigger> seconds of audio before the activity and
+		keep running <idle_hangtime> seconds after (see dutycycle.IdleGate).
+		
+		Monitor object (monitor.Monitor) gets received/sent audio and the
+		carrier, PTT and CTCSS state for the live spectrum and levels.
+		
+		<cw_decode> is the tone frequency (Hz) of CW to decode, None to 
+		disable the Morse decoder.
+		
+		Voice object (voice.Recognizer) extracts features from received 
+		audio while carrier (and CTCSS tone, if decoded) is active; overs
+		are matched against enrolled commands in get_voice_commands(), so 
+		call it from the main loop.
+		
+		History object (history.History) records carrier, PTT, tone and 
+		timeout events and per-second channel metrics.
+		
+		Latency (seconds) sets the soundcard fragment size. Use "auto" to
+		start with the smallest fragment and let Radio grow it when xruns 
+		are detected (and shrink it back after a clean period).
 		"""
 		self.samplerate = samplerate
 		self.verbose = verbose
 		self.ptt = ptt
 		self.carrier = carrier
+		self.scheduler = scheduler
+		self.monitor = monitor
+		self.voice = voice
+		self.history = history
+		self.ctcss_tone = None
+		self.peer_codec = None
 		
 		# Carrier parameters
 		self.fullduplex = fullduplex
+		self.squelch = None
 		
 		# Soundcard parameters
 		self.sampleformat = "S16_LE"
 		self.audio_channels = 1
 		self.buffer_size = 1024
+		self.bufferpool = None
 		self.sample_width = 2
 		self.sample_max = 2.0**(self.sample_width*8) / 2.0
 		
 		# Latency (allowe dbetween 0.01 and secs) gives the fragment size 
+		self.bytes_per_second = samplerate * self.audio_channels * self.sample_width
+		self.autotune = (latency == "auto")
 		self.fragmentsize = None
-		if latency:
-			self.fragmentsize = (samplerate * self.audio_channels * self.sample_width) * latency
-			if self.fragmentsize < 128: self.fragmentsize = 128
-			elif self.fragmentsize > 32768: self.fragmentsize = 32768
-			self.fragmentsize = 2**int(math.log(self.fragmentsize, 2))
+		if self.autotune:
+			self.fragmentsize = self.MINFRAGMENT
+			self.buffer_size = self.fragmentsize
+		elif latency:
+			self.fragmentsize = self.latency_to_fragmentsize(latency)
+		if self.fragmentsize:
 			self.debug("soundcard fragment size: %d bytes" %self.fragmentsize)
+		
+		# Xrun and headroom statistics
+		self.xruns = self.backend_xruns = 0
+		self.time_last_read = self.time_last_tune = None
+		self.xruns_last_tune = 0
+		self.autotune_failed = 0
+		self.headroom = self.headroom_min = 1.0
+		self.read_interval = self.process_time = 0.0
 			
 		self.onoff_dict = {False: "off", True: "on"}
+		self.silence = ""
 		self.ptt_offtime = self.ptt_ontime = self.ptt_tailtime = 0
 		self.carrier_offtime = self.carrier_ontime = self.carrier_tailtime = 0
 		self.carrier_state = None
 		self.set_carrier_state(False)
+		
+		# Noise squelch (carrier detection from discriminator audio)
+		if self.carrier and self.carrier.type == "noise":
+			import squelch
+			self.squelch = squelch.NoiseSquelch(samplerate, self.sample_width, \
+				self.carrier.threshold, getattr(self.carrier, "hysteresis", 1.5), \
+				getattr(self.carrier, "opentime", 0.05), getattr(self.carrier, "closetime", 0.2))
 	
-		# CTCSS generator/decoder		
+		# CTCSS generator, CTCSS/DTMF decoders (optionally on a worker process)
+		self.ctcss_generator = self.ctcss_decoder = None
+		self.dtmf_decoder = self.dsp_worker = self.analyzer = None
 		if ctcss_mintime:
 			import ctcss
 			self.ctcss_generator = ctcss.Generator(self.samplerate, self.sample_width)
-			self.ctcss_decoder = ctcss.Decoder(self.samplerate, self.sample_width, ctcss_mintime)
-		else: self.ctcss_generator = self.ctcss_decoder = None
+		if dsp_worker and (ctcss_mintime or dtmf_decode):
+			import dspworker
+			self.dsp_worker = dspworker.Worker(self.samplerate, self.sample_width, \
+				ctcss_mintime, dtmf_decode, verbose)
+			if ctcss_mintime: self.ctcss_decoder = self.dsp_worker
+			if dtmf_decode: self.dtmf_decoder = self.dsp_worker
+		else:
+			if ctcss_mintime:
+				self.ctcss_decoder = ctcss.Decoder(self.samplerate, self.sample_width, ctcss_mintime)
+			if dtmf_decode:
+				import dtmf
+				self.dtmf_decoder = dtmf.Decoder(self.samplerate, self.sample_width)
+		self.cw_decoder = None
+		if cw_decode:
+			import cs
+			self.cw_decoder = cs.Decoder(self.samplerate, self.sample_width, cw_decode)
+		
+		# Shared spectral analysis for in-process decoders
+		if (self.ctcss_decoder or self.dtmf_decoder or self.cw_decoder) and \
+				(not self.dsp_worker or self.cw_decoder):
+			import analyzer
+			self.analyzer = analyzer.Analyzer(self.samplerate, self.sample_width)
+			if self.ctcss_decoder and not self.dsp_worker: 
+				self.analyzer.add_ctcss(self.ctcss_decoder)
+			if self.dtmf_decoder and not self.dsp_worker: 
+				self.analyzer.add_dtmf(self.dtmf_decoder)
+			if self.cw_decoder: self.analyzer.add_cw(self.cw_decoder)
+		self.idle_gate = None
+		if idle_decode and self.carrier:
+			self.debug("idle decode not used, decoders already follow carrier")
+		elif idle_decode and (ctcss_mintime or dtmf_decode or cw_decode):
+			import dutycycle
+			self.idle_gate = dutycycle.IdleGate(self.samplerate, self.sample_width, \
+				idle_threshold, idle_pretrigger, idle_hangtime)
 		
 		# Open soundcard
 		self.soundcard = None
@@ -109,6 +214,7 @@ class Radio:
 			else: break
 				
 		if not self.soundcard:		
+			if self.dsp_worker: self.dsp_worker.close()
 			raise IOError, "cannot open soundcard: %s" %soundcard_device
 			
 		# Turn PTT off at start (for safety)
@@ -125,6 +231,45 @@ class Radio:
 		args, kwargs = self.open_soundcard_args
 		self.soundcard = soundcard.Soundcard(*args, **kwargs)
 
+	###################################
+	def latency_to_fragmentsize(self, latency):
+		"""Return the fragment size (power of 2, bytes) for a latency (seconds)"""
+		fragmentsize = self.bytes_per_second * latency
+		if fragmentsize < self.MINFRAGMENT: fragmentsize = self.MINFRAGMENT
+		elif fragmentsize > self.MAXFRAGMENT: fragmentsize = self.MAXFRAGMENT
+		return 2**int(math.log(fragmentsize, 2))
+
+	###################################
+	def set_fragmentsize(self, fragmentsize):
+		"""Reopen the soundcard with a new fragment size.
+		
+		If the soundcard cannot be reopened, the previous fragment size is 
+		restored, autotune is disabled and False is returned.
+		"""
+		self.debug("soundcard fragment size: %d -> %d bytes" %(self.fragmentsize, fragmentsize))
+		previous = self.fragmentsize
+		args, kwargs = self.open_soundcard_args
+		kwargs["fragmentsize"] = fragmentsize
+		try: self.reopen_soundcard()
+		except IOError, detail:
+			self.debug("cannot reopen soundcard (%s), fragment size kept: %d bytes, autotune disabled" %(detail, previous))
+			self.autotune = False
+			kwargs["fragmentsize"] = fragmentsize = previous
+			retries = self.REOPEN_RETRIES
+			while 1:
+				try: self.reopen_soundcard()
+				except IOError:
+					retries -= 1
+					if not retries: raise IOError, "cannot reopen soundcard: %s" %self.soundcard_device
+					time.sleep(1)
+				else: break
+		self.fragmentsize = self.buffer_size = fragmentsize
+		self.time_last_read = None
+		self.time_last_tune = time.time()
+		self.xruns_last_tune = self.xruns
+		self.headroom = self.headroom_min = 1.0
+		return previous != fragmentsize
+
 	###################################
 	def debug(self, args, exit = False):
 		"""Write logs to standard error if enabled"""
@@ -146,6 +291,89 @@ class Radio:
 		"""Get audio file descriptor used to interface soundcard"""
 		return self.fragmentsize
 
+	###################################
+	def get_latency_report(self):
+		"""Return a dictionary with latency, xruns and headroom statistics.
+		
+		latency -- Nominal time (seconds) of a fragment
+		measured -- Mean time between soundcard reads
+		processing -- Mean time spent out of the soundcard read
+		headroom -- Mean fraction of the fragment time left unused
+		"""
+		latency = None
+		if self.fragmentsize:
+			latency = float(self.fragmentsize) / self.bytes_per_second
+		return {"fragmentsize": self.fragmentsize, "buffer_size": self.buffer_size, \
+			"latency": latency, "measured": self.read_interval, \
+			"processing": self.process_time, "xruns": self.xruns, \
+			"backend_xruns": self.backend_xruns, "headroom": self.headroom, \
+			"headroom_min": self.headroom_min, "autotune": self.autotune}
+
+	###################################
+	def check_xruns(self, start, size):
+		"""Update xrun and headroom statistics for a read of <size> bytes.
+		
+		<start> is the time the read was requested. Time spent out of the
+		read (processing) is compared against the time the soundcard needs
+		to fill the fragment; a gap longer than the buffered fragments 
+		means the card has overrun. Backend counters are added when the 
+		soundcard object provides get_errors() -> (overruns, underruns).
+		"""
+		now = time.time()
+		period = float(size) / self.bytes_per_second
+		if self.time_last_read:
+			weight = self.HEADROOM_WEIGHT
+			interval = now - self.time_last_read
+			process = start - self.time_last_read
+			headroom = 1.0 - process / period
+			self.read_interval += weight * (interval - self.read_interval)
+			self.process_time += weight * (process - self.process_time)
+			self.headroom += weight * (headroom - self.headroom)
+			if headroom < self.headroom_min: self.headroom_min = headroom
+			if interval > period * self.XRUN_FRAGMENTS:
+				self.xruns += 1
+				self.debug("soundcard xrun: %0.3f secs between reads (fragment: %0.3f)" %(interval, period))
+		self.time_last_read = now
+		
+		get_errors = getattr(self.soundcard, "get_errors", None)
+		if get_errors:
+			try: errors = sum(get_errors())
+			except: errors = self.backend_xruns
+			if errors > self.backend_xruns:
+				self.debug("soundcard backend xruns: %d" %(errors - self.backend_xruns))
+				self.xruns += errors - self.backend_xruns
+			self.backend_xruns = errors
+		
+		if self.autotune: self.tune_fragmentsize(now)
+
+	###################################
+	def tune_fragmentsize(self, now):
+		"""Grow fragment size on xruns, shrink it after a clean period"""
+		if not self.time_last_tune: self.time_last_tune = now
+		xruns = self.xruns - self.xruns_last_tune
+		if xruns >= self.AUTOTUNE_XRUNS:
+			self.autotune_failed = max(self.autotune_failed, self.fragmentsize)
+			if self.fragmentsize < self.MAXFRAGMENT:
+				self.debug("autotune: %d xruns, growing fragment size" %xruns)
+				self.set_fragmentsize(self.fragmentsize * 2)
+			else: self.xruns_last_tune = self.xruns
+		elif now - self.time_last_tune >= self.AUTOTUNE_CLEANTIME:
+			smaller = self.fragmentsize / 2
+			if not xruns and self.headroom_min > self.AUTOTUNE_HEADROOM and \
+					smaller >= self.MINFRAGMENT and smaller > self.autotune_failed:
+				self.debug("autotune: clean period, shrinking fragment size")
+				self.set_fragmentsize(smaller)
+			else:
+				self.time_last_tune = now
+				self.xruns_last_tune = self.xruns
+				self.headroom_min = self.headroom
+
+	#####################################
+	def get_silence(self, length):
+		"""Return a void buffer of <length> bytes (reused while length is kept)"""
+		if len(self.silence) != length: self.silence = "\x00" * length
+		return self.silence
+
 	#####################################
 	def limit_power(self, buffer, limit):
 		power = float(audioop.rms(buffer, self.sample_width)) / self.sample_max
@@ -157,17 +385,125 @@ class Radio:
 	def read_audio(self, size, power_limit=1.0):
 		"""Read data from soundcard""" 
 		if not self.soundcard: self.debug("soundcard not opened"); return
+		start = time.time()
 		buffer = self.soundcard.read(size)
 		if not buffer: return
+		self.check_xruns(start, len(buffer))
 		buffer = self.update_carrier_state(buffer)
 		if power_limit < 1.0:
 			buffer = self.limit_power(buffer, power_limit)
+		if self.monitor: self.monitor.tap("rx", buffer)
+		if self.voice: self.voice.process(buffer, self.is_voice_active())
+		if self.history: self.history.audio(buffer)
 		return buffer
 
+	#####################################
+	def is_voice_active(self):
+		"""Return True if received audio may carry a voice command"""
+		if not self.carrier_state: return False
+		return not self.ctcss_decoder or bool(self.ctcss_decoder.get_tone())
+
+	#####################################
+	def read_audio_into(self, block, power_limit=1.0):
+		"""Read data from soundcard into a preallocated block (bytearray).
+		
+		Audio is muted and power-limited in place. Return the number of 
+		bytes read; use buffer(block, 0, nbytes) to pass it on without 
+		copying (decode_audio, vox_topeer, write_peer, vox_toradio and 
+		send_audio accept it). See read_block for pooled blocks.
+		"""
+		if not self.soundcard: self.debug("soundcard not opened"); return 0
+		start = time.time()
+		readinto = getattr(self.soundcard, "readinto", None)
+		if readinto: nbytes = readinto(block)
+		else:
+			data = self.soundcard.read(len(block))
+			nbytes = len(data)
+			block[:nbytes] = data
+		if not nbytes: return 0
+		self.check_xruns(start, nbytes)
+		view = buffer(block, 0, nbytes)
+		if self.update_carrier(view):
+			memoryview(block)[:nbytes] = self.get_silence(nbytes)
+		elif power_limit < 1.0:
+			power = float(audioop.rms(view, self.sample_width)) / self.sample_max
+			if power > power_limit:
+				block[:nbytes] = audioop.mul(view, self.sample_width, power_limit/power)
+		if (self.monitor and self.monitor.running) or self.voice:
+			data = str(view)
+			if self.monitor: self.monitor.tap("rx", data)
+			if self.voice: self.voice.process(data, self.is_voice_active())
+		if self.history: self.history.audio(view)
+		return nbytes
+
+	#####################################
+	def read_block(self, power_limit=1.0):
+		"""Read a fragment of buffer_size bytes into a pooled block.
+		
+		Return (block, nbytes), (None, 0) if nothing was read. Pass the 
+		audio on as buffer(block, 0, nbytes) and give the block back with
+		release_block() once it has been decoded and sent.
+		"""
+		if not self.bufferpool or self.bufferpool.blocksize != self.buffer_size:
+			import bufferpool
+			self.bufferpool = bufferpool.BufferPool(self.buffer_size)
+		block = self.bufferpool.get()
+		nbytes = self.read_audio_into(block, power_limit)
+		if not nbytes:
+			self.bufferpool.put(block)
+			return None, 0
+		return block, nbytes
+
+	#####################################
+	def release_block(self, block):
+		"""Return a block from read_block to the pool"""
+		if self.bufferpool: self.bufferpool.put(block)
+
+	#####################################
+	def decode_audio(self, buffer):
+		"""Feed received audio to the CTCSS and DTMF decoders"""
+		if self.idle_gate:
+			self.idle_gate.process(buffer, None, self.run_decoders)
+			return
+		if not self.carrier_state: return
+		self.run_decoders(buffer)
+
+	#####################################
+	def run_decoders(self, buffer):
+		self.check_dsp_worker()
+		if self.dsp_worker: self.dsp_worker.decode_buffer(buffer)
+		if self.analyzer: self.analyzer.feed(buffer)
+
+	#####################################
+	def check_dsp_worker(self):
+		"""Replace a dead DSP worker with in-process decoders"""
+		worker = self.dsp_worker
+		if not worker or worker.alive: return
+		self.debug("DSP worker died, decoding in-process")
+		self.dsp_worker = None
+		worker.close()
+		if not self.analyzer:
+			import analyzer
+			self.analyzer = analyzer.Analyzer(self.samplerate, self.sample_width)
+		if self.ctcss_decoder is worker:
+			import ctcss
+			self.ctcss_decoder = ctcss.Decoder(self.samplerate, self.sample_width, \
+				worker.ctcss_mintime)
+			self.analyzer.add_ctcss(self.ctcss_decoder)
+		if self.dtmf_decoder is worker:
+			import dtmf
+			self.dtmf_decoder = dtmf.Decoder(self.samplerate, self.sample_width)
+			self.analyzer.add_dtmf(self.dtmf_decoder)
+
+	#####################################
+	def get_decode_report(self):
+		"""Return duty cycle statistics of the decoders (see dutycycle.IdleGate)"""
+		if not self.idle_gate: return
+		return self.idle_gate.get_report()
+
 	#####################################
 	def decode_ctcss(self, buffer):
-		if not self.ctcss_decoder or not self.carrier_state: return
-		self.ctcss_decoder.decode_buffer(buffer)
+		self.decode_audio(buffer)
 
 	#####################################
 	def clear_ctcss(self):
@@ -178,30 +514,69 @@ class Radio:
 	def get_ctcss_tone(self):
 		#return 200.0
 		if not self.ctcss_decoder: return
-		return self.ctcss_decoder.get_tone()
+		tone = self.ctcss_decoder.get_tone()
+		self.check_dsp_worker()
+		if tone != self.ctcss_tone:
+			self.ctcss_tone = tone
+			if self.monitor: self.monitor.set_state("ctcss", tone)
+			if self.history: self.history.event("ctcss", tone or 0)
+		return tone
+		
+	#####################################
+	def get_dtmf_digits(self):
+		"""Return DTMF keys decoded since last call"""
+		if not self.dtmf_decoder: return ""
+		digits = self.dtmf_decoder.get_digits()
+		self.check_dsp_worker()
+		if self.history:
+			for key in digits: self.history.event("dtmf", ord(key))
+		return digits
+		
+	#####################################
+	def get_cw_text(self):
+		"""Return (char, timestamp) pairs of CW decoded since last call"""
+		if not self.cw_decoder: return []
+		return self.cw_decoder.get_text()
+		
+	#####################################
+	def get_voice_commands(self):
+		"""Match finished overs, return (command, distance, timestamp) 
+		recognized since last call"""
+		if not self.voice: return []
+		return self.voice.get_commands()
 		
 	#####################################
 	def update_carrier_state(self, buffer):
 		"""Update carrier_detection state"""
-		if not self.carrier: return buffer
-		if self.carrier.type == "audio": return buffer
+		# Return a void buffer if there is no carrier detection
+		if self.update_carrier(buffer): return self.get_silence(len(buffer))
+		return buffer
+			
+	#####################################
+	def update_carrier(self, buffer):
+		"""Update carrier_detection state, return True if audio must be muted"""
+		if not self.carrier: return False
+		if self.carrier.type == "audio": return False
+		if self.carrier.type == "noise":
+			self.set_carrier_state(self.squelch.update(buffer))
+			return not self.carrier_state
 		try: next_time = self.time_next_carrier
 		except: next_time = 0
 		now = time.time()
 		if now > next_time:
 			try: self.set_carrier_state(self.carrier.get())
-			except: self.debug("cannot get carrier state"); return buffer
+			except: self.debug("cannot get carrier state"); return False
 			self.time_next_carrier = now + self.carrier.pollingtime			
-		# Return a void buffer if there is no carrier detection
-		if self.carrier and self.carrier.type == "on" and not self.carrier_state:
-			return "\x00" * len(buffer)
-		return buffer
+		return self.carrier.type == "on" and not self.carrier_state
 			
 	########################################
 	def set_carrier_state(self, state):
 		if self.carrier_state != state:
 			self.debug("new carrier state: %s" %self.onoff_dict[state])
 			self.carrier_state = state
+			if self.scheduler: self.scheduler.carrier_changed(state)
+			if self.monitor: self.monitor.set_state("carrier", state)
+			if self.history: self.history.event("carrier", state)
 		
 	########################################
 	def is_ptt_blocked(self):
@@ -220,8 +595,11 @@ class Radio:
 		"""
 		if not self.soundcard: raise IOError, "Soundcard not opened"
 		
+		# Scheduled events must key the PTT too, mix them before VOX
+		if self.scheduler: buffer = self.scheduler.mix(buffer)
+		
 		if not self.ptt: 
-			self.send_audio(buffer, ctcss)
+			self.send_audio(buffer, ctcss, events=False)
 			return
 		
 		# Get power of audio fragment for VOX
@@ -241,6 +619,7 @@ class Radio:
 				else: self.debug("PTT blocked due to carrier detection")
 			elif self.ptt_offtime and now >= self.ptt_offtime and not self.ptt_ontime:
 				self.debug("ptt_max_time timed out: turn PTT off and wait %d seconds" %self.ptt.waittime)
+				if self.history: self.history.event("timeout", 1)
 				self.set_ptt(False)
 				self.ptt_ontime = now + self.ptt.waittime
 			elif self.is_ptt_blocked():
@@ -256,7 +635,7 @@ class Radio:
 				self.set_ptt(False)
 
 		#if self.ptt.get():
-		self.send_audio(buffer, ctcss)
+		self.send_audio(buffer, ctcss, events=False)
 
 	#####################################
 	def vox_topeer(self, peerfd, buffer):
@@ -266,8 +645,7 @@ class Radio:
 		Control minimum and maximum PTT on/off states.
 		"""
 		if not self.carrier or self.carrier.type != "audio": 
-			peerfd.write(buffer)
-			peerfd.flush()
+			self.write_peer(peerfd, buffer)
 			return
 		
 		# Get power of audio fragment for VOX
@@ -285,6 +663,7 @@ class Radio:
 				self.set_carrier_state(True)
 			elif self.carrier_offtime and now >= self.carrier_offtime and not self.carrier_ontime:
 				self.debug("carrier_max_time timed out: disabling carrier_detection for %d seconds" %self.ptt.waittime)
+				if self.history: self.history.event("timeout", 2)
 				self.set_carrier_state(False)
 				self.carrier_ontime = now + self.carrier.waittime
 				
@@ -293,26 +672,81 @@ class Radio:
 			self.set_carrier_state(False)
 
 		#if self.ptt.get():
+		self.write_peer(peerfd, buffer)
+
+	#####################################
+	def set_peer_codec(self, codec):
+		"""Set codec (codec.Codec) for audio exchanged with the peer, None for PCM"""
+		self.peer_codec = codec
+		if codec: self.debug("peer codec: %s, %d samples/frame" %(codec.name, codec.framesize))
+
+	#####################################
+	def negotiate_peer(self, peerfd, codecs=None, framesize=160):
+		"""Agree a codec with the peer (see codec.negotiate) and use it"""
+		import codec
+		if codecs is None: codecs = codec.PREFERENCE
+		self.set_peer_codec(codec.negotiate(peerfd, codecs, framesize))
+		return self.peer_codec
+
+	#####################################
+	def read_peer(self, peerfd, size):
+		"""Read audio from the peer, <size> is in bytes of linear audio"""
+		if self.peer_codec: size = self.peer_codec.encoded_size(size)
+		return self.decode_peer(peerfd.read(size))
+
+	#####################################
+	def decode_peer(self, data):
+		"""Decode data received from the peer with the negotiated codec"""
+		if not self.peer_codec: return data
+		return self.peer_codec.decode(data)
+
+	#####################################
+	def write_peer(self, peerfd, buffer):
+		"""Write audio to the peer, encoded with the negotiated codec"""
+		if self.peer_codec:
+			buffer = self.peer_codec.encode(buffer)
+			if not buffer: return
 		peerfd.write(buffer)
 		peerfd.flush()
 			
 
 	#####################################
-	def send_audio(self, buffer, ctcss=None):
+	def send_audio(self, buffer, ctcss=None, events=True):
 		"""Send audio to radio transceiver using the soundcard
 		
 		ctcss -- Tuple containing (frequecy, amplitude) for CTCSS code generation
+		events -- Mix scheduled events (IDs, announcements) into the buffer
+		
+		<buffer> may be a buffer() view of a pooled block: with no CTCSS 
+		and no event playing it is written without copying.
 		"""
 		if not self.soundcard: self.debug("soundcard not opened"); return
 		if not buffer: return
+		
+		if events and self.scheduler:
+			buffer = self.scheduler.mix(buffer)
 				
 		if ctcss and self.ctcss_generator:
 			freq, amplitude = ctcss
 			ctcss_buffer = self.ctcss_generator.generate(len(buffer), amplitude, freq)
 			buffer = audioop.add(buffer, ctcss_buffer, self.sample_width)
 
+		if self.monitor and self.monitor.running:
+			self.monitor.tap("tx", str(buffer))
 		self.soundcard.write(buffer)
 
+	#####################################
+	def send_events(self, size, ctcss=None):
+		"""Send scheduled events when there is no audio to repeat.
+		
+		Call it from the main loop when the channel is idle; it sends a
+		fragment of <size> bytes (through VOX) if an event is due, and 
+		keeps sending silence until the PTT tail time releases the PTT.
+		"""
+		if not self.scheduler: return
+		if not self.scheduler.busy() and not (self.ptt and self.ptt.get()): return
+		self.vox_toradio(self.get_silence(size), ctcss)
+
 	#####################################
 	def flush_audio(self):
 		"""Flush buffer soundcard"""
@@ -329,10 +763,17 @@ class Radio:
 			self.debug("soundcard closed")
 		else: self.debug("soundcard was not opened")
 		
+		if self.dsp_worker:
+			self.dsp_worker.close()
+			self.dsp_worker = None
+		
 		self.set_ptt(False)
 
 	###################################
 	def set_ptt(self, value):
 		if not self.ptt: return
 		self.debug("set PTT: %s" %self.onoff_dict[bool(value)])
-		self.ptt.set(value)
\ No newline at end of file
+		self.ptt.set(value)
+		if self.scheduler: self.scheduler.ptt_changed(bool(value))
+		if self.monitor: self.monitor.set_state("ptt", bool(value))
+		if self.history: self.history.event("ptt", bool(value))
\ No newline at end of file
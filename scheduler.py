@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Timed audio events (auto identify, announcements) for RepeaterPi
+#
+# Events are kept in a heap ordered by their due time and are mixed into
+# the outgoing audio (Radio.send_audio) one fragment at a time, so an ID
+# never blocks the capture loop nor delays the repeated audio.
+
+# Standard Python modules
+import sys, time, math
+import heapq, struct, audioop
+
+# RepeaterPi modules
+import cs
+
+#########################
+class Event:
+	"""Timed audio event.
+
+	<audio> is the PCM data to be played (same format as the radio) or a
+	callable returning it, so long announcements are rendered only when due.
+
+	interval -- Reschedule the event <interval> seconds after each start
+	polite -- Do not start while carrier is detected, wait for the over to end
+	maxdelay -- Seconds a polite event may wait, then it plays over the voice
+	onactivity -- Repeat only if the transmitter was keyed since the last start
+	ontail -- Play when the carrier drops (tail announcement)
+	duck -- Factor applied to the voice audio while the event is playing
+	"""
+	#########################
+	def __init__(self, name, audio, when=None, interval=None, polite=False, \
+		ontail=False, duck=None, maxdelay=None, onactivity=False):
+		self.name = name
+		self.audio = audio
+		self.when = when or time.time()
+		self.interval = interval
+		self.polite = polite
+		self.ontail = ontail
+		self.duck = duck
+		self.maxdelay = maxdelay
+		self.onactivity = onactivity
+
+	#########################
+	def can_start(self, carrier_state, now):
+		"""Return True unless the event must wait for the over to end"""
+		if not self.polite or not carrier_state: return True
+		return self.maxdelay is not None and now - self.when >= self.maxdelay
+
+	#########################
+	def render(self):
+		if callable(self.audio): return self.audio()
+		return self.audio
+
+#########################
+class Scheduler:
+	"""Queue timed audio events and mix them into the outgoing audio.
+
+	Only one event plays at a time; the rest wait in order of their due
+	time. While an event plays, voice audio is multiplied by <duck>.
+	"""
+	# Polite ID waits at most CWID_MAXDELAY, so IDs stay 10 minutes apart
+	CWID_INTERVAL = 540
+	CWID_MAXDELAY = 60
+
+	#########################
+	def __init__(self, samplerate, samplewidth, duck=0.3, verbose=False):
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.samplemax = 2.0**(8*samplewidth) / 2.0
+		self.duck = duck
+		self.verbose = verbose
+		self.heap = []
+		self.sequence = 0
+		self.waiting = []
+		self.tail = []
+		self.playing = None
+		self.data = ""
+		self.offset = 0
+		self.carrier_state = False
+		self.ptt_state = False
+		self.transmitted = False
+		self.parked = []
+
+	###################################
+	def debug(self, args):
+		"""Write logs to standard error if enabled"""
+		if not self.verbose: return
+		sys.stderr.write("scheduler -- " + str(args) + "\n")
+		sys.stderr.flush()
+
+	#########################
+	def add(self, event):
+		"""Queue an event to be played at event.when"""
+		self.sequence += 1
+		heapq.heappush(self.heap, (event.when, self.sequence, event))
+		return event
+
+	#########################
+	def remove(self, name):
+		"""Remove all queued events with the given name"""
+		self.heap = [x for x in self.heap if x[2].name != name]
+		heapq.heapify(self.heap)
+		self.waiting = [x for x in self.waiting if x.name != name]
+		self.tail = [x for x in self.tail if x.name != name]
+		self.parked = [x for x in self.parked if x.name != name]
+
+	#########################
+	def add_cwid(self, callsign, interval=CWID_INTERVAL, wpm=20, freq=800.0, \
+		amplitude=0.3, polite=True, when=None, maxdelay=CWID_MAXDELAY):
+		"""Queue a periodic CW identification of <callsign>.
+
+		The ID repeats only while the repeater transmits: once an interval
+		passes without PTT activity, it waits for the next key up.
+		"""
+		render = lambda: self.morse(callsign, wpm, freq, amplitude)
+		return self.add(Event("cwid", render, when, interval, polite, \
+			maxdelay=maxdelay, onactivity=True))
+
+	#########################
+	def add_announcement(self, name, audio, when=None, ontail=False, polite=True):
+		"""Queue an announcement (PCM data or callable returning it)"""
+		return self.add(Event(name, audio, when, polite=polite, ontail=ontail))
+
+	#########################
+	def tone(self, length, freq, amplitude):
+		"""Return <length> samples of a sine tone with raised cosine edges"""
+		ramp = min(length / 2, int(self.samplerate * 0.005))
+		k = 2*math.pi*freq/self.samplerate
+		peak = self.samplemax * amplitude
+		samples = []
+		for x in xrange(length):
+			value = peak * math.sin(k*x)
+			if x < ramp: value *= 0.5 - 0.5*math.cos(math.pi*x/ramp)
+			elif x >= length - ramp: value *= 0.5 - 0.5*math.cos(math.pi*(length-x)/ramp)
+			samples.append(int(value))
+		return struct.pack("<%dh" %length, *samples)
+
+	#########################
+	def morse(self, text, wpm, freq, amplitude):
+		"""Render <text> as CW audio (PARIS timing: dot = 1.2/wpm seconds)"""
+		length = int(self.samplerate * 1.2 / wpm)
+		dot = self.tone(length, freq, amplitude)
+		dah = self.tone(3*length, freq, amplitude)
+		gap = "\x00" * (length * self.samplewidth)
+		# 1 (element) + 2 (character) + 2 + 2 (character) = 7 units between words
+		units = {".": dot + gap, "-": dah + gap, "\001": gap * 2, " ": gap * 2}
+		return "".join([units.get(c, "") for c in cs.morse(text)])
+
+	#########################
+	def carrier_changed(self, state):
+		"""Notify carrier state, tail and polite events start on carrier drop"""
+		self.carrier_state = state
+		if state: return
+		if self.tail: self.debug("carrier dropped, %d tail events ready" %len(self.tail))
+		self.waiting.extend(self.tail)
+		self.tail = []
+
+	#########################
+	def ptt_changed(self, state):
+		"""Notify PTT state, parked periodic events start again on key up"""
+		self.ptt_state = state
+		# The PTT keyed by our own event is not activity
+		if not state or self.playing: return
+		self.transmitted = True
+		now = time.time()
+		for event in self.parked:
+			self.debug("transmitter keyed, event rearmed: %s" %event.name)
+			event.when = now
+			self.add(event)
+		self.parked = []
+
+	#########################
+	def busy(self):
+		"""Return True if an event is playing or ready to be played"""
+		if self.playing: return True
+		now = time.time()
+		for event in self.waiting:
+			if event.can_start(self.carrier_state, now): return True
+		return bool(self.heap) and self.heap[0][0] <= now and \
+			self.heap[0][2].can_start(self.carrier_state, now)
+
+	#########################
+	def next_event(self, now):
+		"""Move due events from the heap and return the next one to play"""
+		while self.heap and self.heap[0][0] <= now:
+			when, sequence, event = heapq.heappop(self.heap)
+			if event.onactivity:
+				if not self.transmitted:
+					self.debug("no transmitter activity, event parked: %s" %event.name)
+					self.parked.append(event)
+					continue
+				self.transmitted = self.ptt_state
+			if event.interval:
+				# Skip repetitions missed while mix() was not called
+				when += event.interval
+				while when <= now: when += event.interval
+				self.add(Event(event.name, event.audio, when, event.interval, \
+					event.polite, event.ontail, event.duck, event.maxdelay, \
+					event.onactivity))
+			queue = self.waiting
+			if event.ontail: queue = self.tail
+			if event.name in [x.name for x in queue]: continue
+			queue.append(event)
+		for event in self.waiting:
+			if not event.can_start(self.carrier_state, now): continue
+			self.waiting.remove(event)
+			return event
+
+	#########################
+	def mix(self, buffer):
+		"""Mix the playing event (if any) into <buffer>, one fragment at a time"""
+		if not self.playing:
+			if not self.heap and not self.waiting: return buffer
+			self.playing = self.next_event(time.time())
+			if not self.playing: return buffer
+			self.debug("playing event: %s" %self.playing.name)
+			self.data, self.offset = self.playing.render(), 0
+
+		length = len(buffer)
+		fragment = self.data[self.offset:self.offset+length]
+		self.offset += length
+		if len(fragment) < length:
+			fragment += "\x00" * (length - len(fragment))
+
+		duck = self.playing.duck
+		if duck is None: duck = self.duck
+		if duck < 1.0 and audioop.max(buffer, self.samplewidth):
+			buffer = audioop.mul(buffer, self.samplewidth, duck)
+		if self.offset >= len(self.data):
+			self.debug("event finished: %s" %self.playing.name)
+			self.playing, self.data, self.offset = None, "", 0
+		return audioop.add(buffer, fragment, self.samplewidth)
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# Noise squelch for RepeaterPi
+#
+# Carrier detection from discriminator audio: an FM receiver without a
+# signal outputs strong noise above the voice band, which quiets down when
+# a carrier is received. The noise is measured on every buffer with a
+# fourth difference high-pass filter (on 32-bit samples) and an envelope
+# follower (audioop only, no per-sample Python code).
+
+# Standard Python modules
+import math, audioop
+
+#########################
+class NoiseSquelch:
+	"""Open when out-of-band noise drops below <threshold>.
+
+	threshold -- Noise level (fraction of full scale) that opens the squelch
+	hysteresis -- The squelch closes when noise exceeds threshold*hysteresis
+	opentime -- Seconds the noise must stay low before opening
+	closetime -- Seconds the noise must stay high before closing
+
+	The filter gain rises with frequency (+24 dB/octave) and is scaled to 
+	read white noise at its RMS level. A near full scale 2500 Hz tone reads
+	0.06 at 16000 sps (0.001 at 48000 sps), so the soundcard must sample 
+	well above the voice band: lower rates (< MINRATE) are refused.
+	"""
+	ENVELOPE_TIME = 0.01
+	MINRATE = 16000
+	ORDER = 4
+	# Filter gain for white noise: sqrt(binomial(2*ORDER, ORDER))
+	NOISE_GAIN = math.sqrt(70.0)
+	# Peak filter gain is 2**ORDER, keep it below full scale
+	HEADROOM = 1.0 / 2**ORDER
+
+	#########################
+	def __init__(self, samplerate, samplewidth, threshold=0.1, hysteresis=1.5, \
+		opentime=0.05, closetime=0.2):
+		if samplerate < self.MINRATE:
+			raise ValueError, "Noise squelch needs %d sps or more: %s" %(self.MINRATE, samplerate)
+		self.samplerate = samplerate
+		self.samplewidth = samplewidth
+		self.threshold = threshold
+		self.close_threshold = threshold * hysteresis
+		self.opentime = opentime
+		self.closetime = closetime
+		self.envelope = 1.0
+		self.state = False
+		self.pending = 0.0
+
+	#########################
+	def get_noise(self):
+		"""Return current noise envelope (fraction of full scale)"""
+		return self.envelope
+
+	#########################
+	def measure(self, buffer):
+		"""Return RMS of the high-passed buffer (fraction of full scale)"""
+		diff = audioop.mul(audioop.lin2lin(buffer, self.samplewidth, 4), 4, self.HEADROOM)
+		for order in range(self.ORDER):
+			diff = audioop.add(diff[4:], audioop.mul(diff[:-4], 4, -1), 4)
+		return audioop.rms(diff, 4) / (self.HEADROOM * self.NOISE_GAIN * 2.0**31)
+
+	#########################
+	def update(self, buffer):
+		"""Process a received buffer and return squelch state (True = open)"""
+		if len(buffer) <= self.ORDER*self.samplewidth: return self.state
+		duration = float(len(buffer)) / (self.samplewidth * self.samplerate)
+		weight = 1.0 - math.exp(-duration / self.ENVELOPE_TIME)
+		self.envelope += weight * (self.measure(buffer) - self.envelope)
+
+		if self.state: change = self.envelope > self.close_threshold
+		else: change = self.envelope < self.threshold
+		if not change:
+			self.pending = 0.0
+			return self.state
+		self.pending += duration
+		if self.state: holdtime = self.closetime
+		else: holdtime = self.opentime
+		if self.pending >= holdtime:
+			self.state = not self.state
+			self.pending = 0.0
+		return self.state
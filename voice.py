@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Voice command front-end for RepeaterPi
+#
+# While carrier (and CTCSS, if used) is active, received audio is framed
+# and turned into MFCC features incrementally with precomputed window,
+# mel filterbank and DCT matrices. When the over ends, the utterance is
+# queued and later (get_commands, from the main loop) matched against a few
+# locally enrolled templates with a banded DTW that abandons a template as
+# soon as it cannot beat the best match so far. Templates are stacked in a
+# matrix, so each DTW row needs a single matrix product.
+
+# Standard Python modules
+import sys, time, math
+import struct, cPickle
+import numarray, numarray.fft
+
+#########################
+class Features:
+	"""Incremental MFCC extraction.
+
+	frametime -- Analysis frame length (seconds)
+	steptime -- Frame step (seconds)
+	nfilters -- Mel filters between LOWFREQ and samplerate/2 (or HIGHFREQ)
+	ncoeffs -- Cepstral coefficients kept (c0, the log energy, is dropped)
+	"""
+	LOWFREQ = 200.0
+	HIGHFREQ = 3400.0
+	FLOOR = 1e-10
+
+	#########################
+	def __init__(self, samplerate=8000, samplewidth=2, frametime=0.025, \
+		steptime=0.01, nfilters=20, ncoeffs=12):
+		if samplewidth != 2:
+			raise ValueError, "Invalid sample width: %s" %samplewidth
+		self.samplewidth = samplewidth
+		self.framesize = int(samplerate * frametime)
+		self.stepsize = int(samplerate * steptime)
+		self.fftsize = 2**int(math.ceil(math.log(self.framesize, 2)))
+		self.window = bytearray(self.framesize * samplewidth)
+		self.format = "<%dh" %self.framesize
+		self.fill = 0
+		self.hamming = numarray.array([0.54 - 0.46*math.cos(2*math.pi*x/(self.framesize-1)) \
+			for x in xrange(self.framesize)])
+		self.padding = numarray.zeros(self.fftsize - self.framesize, numarray.Float64)
+		self.melbank = numarray.array(self.mkmelbank(samplerate, nfilters))
+		self.dct = numarray.array([[math.cos(math.pi*k*(n+0.5)/nfilters) \
+			for n in range(nfilters)] for k in range(1, ncoeffs+1)])
+
+	#########################
+	def mkmelbank(self, samplerate, nfilters):
+		"""Return triangular mel filters (one row per filter, one column per FFT bin)"""
+		mel = lambda f: 2595.0 * math.log10(1 + f/700.0)
+		hertz = lambda m: 700.0 * (10**(m/2595.0) - 1)
+		high = min(self.HIGHFREQ, samplerate / 2.0)
+		low, high = mel(self.LOWFREQ), mel(high)
+		edges = [hertz(low + (high-low)*i/(nfilters+1)) for i in range(nfilters+2)]
+		nbins = self.fftsize/2 + 1
+		freqs = [float(samplerate) * i / self.fftsize for i in range(nbins)]
+		bank = []
+		for i in range(nfilters):
+			left, center, right = edges[i:i+3]
+			row = []
+			for f in freqs:
+				if left < f <= center: row.append((f - left) / (center - left))
+				elif center < f < right: row.append((right - f) / (right - center))
+				else: row.append(0.0)
+			bank.append(row)
+		return bank
+
+	#########################
+	def reset(self):
+		self.fill = 0
+
+	#########################
+	def process(self, buffer):
+		"""Return the feature vectors of the frames completed by <buffer>"""
+		# Fill the preallocated window, shift it by a step after each frame
+		length = len(self.window)
+		keep = length - self.stepsize * self.samplewidth
+		frames = []
+		position, total = 0, len(buffer)
+		while position < total:
+			count = min(total - position, length - self.fill)
+			self.window[self.fill:self.fill+count] = buffer[position:position+count]
+			self.fill += count
+			position += count
+			if self.fill < length: break
+			samples = numarray.array(struct.unpack_from(self.format, self.window))
+			self.window[:keep] = self.window[length-keep:]
+			self.fill = keep
+			frame = numarray.concatenate((samples * self.hamming, self.padding))
+			power = abs(numarray.fft.real_fft(frame))**2
+			logmel = numarray.log(numarray.dot(self.melbank, power) + self.FLOOR)
+			frames.append(numarray.dot(self.dct, logmel))
+		return frames
+
+#########################
+def stack(frames):
+	"""Return (matrix, norms) of a feature sequence, as used by dtw()"""
+	matrix = numarray.array(frames)
+	return matrix, [numarray.dot(frame, frame) for frame in frames]
+
+#########################
+def dtw(query, template, band, best=None, norms=None):
+	"""Banded DTW distance (mean per step) between two feature sequences.
+
+	<template> is a matrix (one row per frame, see stack) and <norms> the
+	squared norms of its rows. Return None as soon as every path already 
+	costs more than <best>.
+	"""
+	nquery, ntemplate = len(query), len(template)
+	if abs(nquery - ntemplate) > band: return
+	if norms is None: template, norms = stack(template)
+	infinity = float("inf")
+	limit = infinity
+	if best is not None: limit = best * (nquery + ntemplate)
+	previous = [0.0] + [infinity] * ntemplate
+	for i in range(nquery):
+		start, end = max(0, i - band), min(ntemplate, i + band + 1)
+		q = query[i]
+		qnorm = numarray.dot(q, q)
+		products = numarray.dot(template[start:end], q)
+		current = [infinity] * (ntemplate + 1)
+		for j in range(start, end):
+			distance = math.sqrt(max(0.0, qnorm + norms[j] - 2*products[j-start]))
+			current[j+1] = distance + min(previous[j], previous[j+1], current[j])
+		if min(current) > limit: return
+		previous = current
+	return previous[ntemplate] / (nquery + ntemplate)
+
+#########################
+class Recognizer:
+	"""Match overs against enrolled command templates.
+
+	threshold -- Maximum DTW distance accepted as a command
+	maxtime -- Longer overs are not analysed (keeps CPU use bounded)
+	band -- DTW band (seconds)
+	"""
+	#########################
+	def __init__(self, samplerate=8000, samplewidth=2, threshold=15.0, maxtime=3.0, \
+		band=0.2, verbose=False):
+		self.features = Features(samplerate, samplewidth)
+		steptime = float(self.features.stepsize) / samplerate
+		self.maxframes = int(maxtime / steptime)
+		self.band = int(band / steptime)
+		self.threshold = threshold
+		self.verbose = verbose
+		self.templates = {}
+		self.frames = []
+		self.active = False
+		self.overflow = False
+		self.utterances = []
+		self.commands = []
+
+	###################################
+	def debug(self, args):
+		"""Write logs to standard error if enabled"""
+		if not self.verbose: return
+		sys.stderr.write("voice -- " + str(args) + "\n")
+		sys.stderr.flush()
+
+	#########################
+	def enroll(self, name, buffer):
+		"""Add a template for command <name> from a recorded buffer"""
+		self.features.reset()
+		frames = self.features.process(buffer)
+		self.features.reset()
+		if not frames: raise ValueError, "Recording too short for command: %s" %name
+		self.templates.setdefault(name, []).append(stack(frames))
+
+	#########################
+	def save(self, path):
+		templates = {}
+		for name, items in self.templates.items():
+			templates[name] = [[list(frame) for frame in matrix] for matrix, norms in items]
+		fd = open(path, "wb")
+		try: cPickle.dump(templates, fd, 2)
+		finally: fd.close()
+
+	#########################
+	def load(self, path):
+		fd = open(path, "rb")
+		try: templates = cPickle.load(fd)
+		finally: fd.close()
+		for name, items in templates.items():
+			self.templates[name] = [stack([numarray.array(frame) for frame in frames]) \
+				for frames in items]
+
+	#########################
+	def process(self, buffer, active):
+		"""Extract features while <active> (carrier/CTCSS), queue the utterance
+		when it ends (matched by get_commands)"""
+		if active:
+			if not self.active:
+				self.active, self.overflow = True, False
+				self.features.reset()
+				self.frames = []
+			if self.overflow: return
+			self.frames.extend(self.features.process(buffer))
+			if len(self.frames) > self.maxframes:
+				self.debug("over too long for a command, ignored")
+				self.overflow, self.frames = True, []
+		elif self.active:
+			self.active = False
+			if self.frames: self.utterances.append((self.frames, time.time()))
+			self.frames = []
+
+	#########################
+	def match(self, frames, timestamp=None):
+		"""Find the closest template, queue the command if close enough"""
+		if timestamp is None: timestamp = time.time()
+		best, command = self.threshold, None
+		for name, items in self.templates.items():
+			for template, norms in items:
+				distance = dtw(frames, template, self.band, best, norms)
+				if distance is not None and distance < best:
+					best, command = distance, name
+		if command:
+			self.debug("command: %s (distance %0.2f)" %(command, best))
+			self.commands.append((command, best, timestamp))
+
+	#########################
+	def get_commands(self):
+		"""Match queued utterances, return (command, distance, timestamp)
+		recognized since last call. Call it from the main loop, not from the
+		audio read path."""
+		utterances, self.utterances = self.utterances, []
+		for frames, timestamp in utterances:
+			self.match(frames, timestamp)
+		commands, self.commands = self.commands, []
+		return commands